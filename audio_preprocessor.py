@@ -2,25 +2,201 @@
 Audio preprocessing module for Vietnamese Speech-to-Text
 Handles audio format conversion, resampling, and normalization
 """
-import librosa
 import soundfile as sf
 import numpy as np
-from pydub import AudioSegment
-import io
 import os
-from typing import Union, Tuple
+import math
+import functools
+import shutil
+import subprocess
+import threading
+from typing import Union, Tuple, Optional, BinaryIO
 import logging
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import numpy_rms
+except ImportError:
+    numpy_rms = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Default loudness target for RMS normalization
+DEFAULT_TARGET_DB = -20.0
+
+# Frames decoded per block by the streaming pipeline
+STREAM_BLOCK_SIZE = 65536
+
+# Distinct (orig_sr, target_sr) resamplers kept; uploads arrive at arbitrary
+# rates, so the cache is bounded
+RESAMPLER_CACHE_SIZE = 16
+
+
+@functools.lru_cache(maxsize=RESAMPLER_CACHE_SIZE)
+def _get_resampler(orig_sr: int, target_sr: int):
+    """
+    Get a cached torchaudio resampler for a sample rate pair
+
+    The kaiser-window sinc filter bank is built once per (orig_sr, target_sr)
+    pair and reused, so each call is a single strided convolution.
+    """
+    import torchaudio
+    return torchaudio.transforms.Resample(
+        orig_freq=orig_sr,
+        new_freq=target_sr,
+        lowpass_filter_width=16,
+        rolloff=0.99,
+        resampling_method="sinc_interp_kaiser"
+    )
+
+
+def _resample_polyphase(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    """Resample with the cached torchaudio filter bank, or scipy's resample_poly without torch"""
+    try:
+        import torch
+        resampler = _get_resampler(orig_sr, target_sr)
+        with torch.no_grad():
+            audio_tensor = torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)).unsqueeze(0)
+            return resampler(audio_tensor).squeeze(0).numpy()
+    except ImportError:
+        # Fall back to scipy's polyphase filter with the reduced up/down ratio
+        from scipy.signal import resample_poly
+        g = math.gcd(orig_sr, target_sr)
+        return resample_poly(audio, up=target_sr // g, down=orig_sr // g)
+
+
+def _probe_duration(file_path: str) -> Optional[float]:
+    """
+    Get audio duration in seconds from the container header
+    
+    Tries soundfile's header read first, then ffprobe for containers
+    libsndfile can't open (mp4/webm/...), and only decodes the stream
+    with librosa as a last resort.
+    
+    Args:
+        file_path: Path to audio/video file
+        
+    Returns:
+        Duration in seconds, or None if it could not be determined
+    """
+    try:
+        return sf.info(file_path).duration
+    except Exception as sf_error:
+        logger.warning(f"Could not get duration using soundfile: {sf_error}")
+    
+    if shutil.which("ffprobe"):
+        try:
+            result = subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", file_path],
+                capture_output=True, text=True, check=True, timeout=10
+            )
+            return float(result.stdout.strip())
+        except Exception as ffprobe_error:
+            logger.warning(f"Could not get duration using ffprobe: {ffprobe_error}")
+    
+    try:
+        import librosa
+        return librosa.get_duration(path=file_path)
+    except Exception as librosa_error:
+        logger.warning(f"Could not get duration using librosa: {librosa_error}")
+    
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_duration(file_path: str, mtime_ns: int, size: int) -> Optional[float]:
+    """Memoize header duration probes; mtime/size in the key invalidate edited files"""
+    return _probe_duration(file_path)
+
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _normalize_kernel(audio, out, target_rms):
+        """
+        Fused RMS normalization: sum-of-squares, gain and clip in one kernel
+
+        Returns False (leaving out untouched) when the signal is silent.
+        """
+        n = audio.shape[0]
+        ss = 0.0
+        for i in numba.prange(n):
+            ss += audio[i] * audio[i]
+        if n == 0 or ss == 0.0:
+            return False
+        gain = target_rms / np.sqrt(ss / n)
+        for i in numba.prange(n):
+            # Ternary clamps lower to vmaxps/vminps, keeping the loop branch-free
+            v = audio[i] * gain
+            v = 1.0 if v > 1.0 else v
+            v = -1.0 if v < -1.0 else v
+            out[i] = v
+        return True
+else:
+    _normalize_kernel = None
+
+
+def _compute_rms(audio: np.ndarray) -> float:
+    """Compute RMS of a mono signal, using numpy-rms's SIMD kernel when available"""
+    if numpy_rms is not None and audio.size > 0:
+        # Contiguous float32 input takes the SSE2/AVX2 path instead of the scalar fallback
+        samples = np.ascontiguousarray(audio, dtype=np.float32)
+        return float(numpy_rms.rms(samples, window_size=samples.shape[0])[0])
+    if audio.size == 0:
+        return 0.0
+    # Dot product is a single pass with no squared temporary
+    return float(np.sqrt(np.dot(audio, audio) / audio.size))
+
+
+# Sample rates Silero VAD accepts
+VAD_SAMPLE_RATES = (8000, 16000)
+
+# The VAD model keeps recurrent state between calls, so sessions take turns
+_VAD_LOCK = threading.Lock()
+
+# Loaded Silero VAD (model, get_speech_timestamps); only successes are stored
+_VAD_CACHE = {}
+
+
+def _get_silero_vad():
+    """
+    Load (and memoize) the Silero VAD model from the pinned silero-vad package
+    
+    Returns:
+        Tuple of (model, get_speech_timestamps)
+        
+    Raises:
+        Exception: If the package or model can't be loaded; nothing is cached,
+        so the next call tries again
+    """
+    vad = _VAD_CACHE.get("silero")
+    if vad is None:
+        with _VAD_LOCK:
+            vad = _VAD_CACHE.get("silero")
+            if vad is None:
+                from silero_vad import load_silero_vad, get_speech_timestamps
+                vad = (load_silero_vad(), get_speech_timestamps)
+                _VAD_CACHE["silero"] = vad
+    return vad
+
+
 class AudioPreprocessor:
     """Audio preprocessing class for speech-to-text"""
     
     def __init__(self, target_sample_rate: int = 16000):
         self.target_sample_rate = target_sample_rate
         
-    def validate_audio_file(self, file_path: str, max_duration: int = 600, max_size_mb: int = 100) -> bool:
+        # Pre-warm the JIT so the first real request doesn't pay compile latency
+        if _normalize_kernel is not None:
+            warmup = np.zeros(1, dtype=np.float32)
+            _normalize_kernel(warmup, warmup, np.float32(0.1))
+        
+    def validate_audio_file(self, file_path: str, max_duration: int = 600, max_size_mb: int = 100,
+                            stat_result: Optional[os.stat_result] = None) -> bool:
         """
         Validate audio file constraints
         
@@ -28,37 +204,26 @@ class AudioPreprocessor:
             file_path: Path to audio file
             max_duration: Maximum duration in seconds
             max_size_mb: Maximum file size in MB
+            stat_result: Precomputed os.stat() of the file (e.g. from os.scandir)
             
         Returns:
             bool: True if file is valid, False otherwise
         """
         try:
+            # Stat once; size and mtime both come from the same syscall
+            st = stat_result if stat_result is not None else os.stat(file_path)
+            
             # Check file size
-            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+            file_size_mb = st.st_size / (1024 * 1024)
             if file_size_mb > max_size_mb:
                 logger.error(f"File size {file_size_mb:.2f}MB exceeds limit of {max_size_mb}MB")
                 return False
             
-            # Check duration
-            try:
-                duration = librosa.get_duration(path=file_path)
-                if duration > max_duration:
-                    logger.error(f"Duration {duration:.2f}s exceeds limit of {max_duration}s")
-                    return False
-            except Exception as duration_error:
-                logger.warning(f"Could not get duration using librosa: {duration_error}")
-                # Try alternative method
-                try:
-                    import soundfile as sf
-                    info = sf.info(file_path)
-                    duration = info.duration
-                    if duration > max_duration:
-                        logger.error(f"Duration {duration:.2f}s exceeds limit of {max_duration}s")
-                        return False
-                except Exception as sf_error:
-                    logger.warning(f"Could not get duration using soundfile: {sf_error}")
-                    # Skip duration check if both methods fail
-                    pass
+            # Check duration (header read only; skipped if it can't be determined)
+            duration = _cached_duration(file_path, st.st_mtime_ns, st.st_size)
+            if duration is not None and duration > max_duration:
+                logger.error(f"Duration {duration:.2f}s exceeds limit of {max_duration}s")
+                return False
                 
             return True
             
@@ -78,9 +243,13 @@ class AudioPreprocessor:
             Tuple of (audio_array, sample_rate)
         """
         try:
+            # librosa's import chain is heavy, so only pay for it when loading
+            import librosa
+            
             # Try loading with librosa first
             try:
-                audio, sr = librosa.load(file_path, sr=None, mono=False)
+                # Let librosa downmix and resample in one pass while decoding
+                audio, sr = librosa.load(file_path, sr=self.target_sample_rate, mono=True)
                 logger.info(f"Loaded audio with librosa: {audio.shape}, sample_rate: {sr}")
             except Exception as librosa_error:
                 logger.warning(f"Librosa failed: {librosa_error}")
@@ -89,7 +258,8 @@ class AudioPreprocessor:
                     import soundfile as sf
                     audio, sr = sf.read(file_path)
                     if len(audio.shape) > 1:
-                        audio = librosa.to_mono(audio)
+                        # soundfile returns (frames, channels); librosa expects channels first
+                        audio = librosa.to_mono(audio.T)
                     logger.info(f"Loaded audio with soundfile: {audio.shape}, sample_rate: {sr}")
                 except Exception as sf_error:
                     logger.warning(f"Soundfile failed: {sf_error}")
@@ -118,10 +288,9 @@ class AudioPreprocessor:
                         logger.error(f"All methods failed: {pydub_error}")
                         raise Exception(f"Could not load audio file. Librosa: {librosa_error}, Soundfile: {sf_error}, Pydub: {pydub_error}")
             
-            # Convert to mono if stereo
-            if len(audio.shape) > 1:
-                audio = librosa.to_mono(audio)
-                
+            # Keep everything downstream in contiguous float32
+            audio = np.ascontiguousarray(audio, dtype=np.float32)
+            
             logger.info(f"Final audio: {audio.shape}, sample_rate: {sr}")
             return audio, sr
             
@@ -148,7 +317,12 @@ class AudioPreprocessor:
             return audio
             
         try:
-            resampled_audio = librosa.resample(audio, orig_sr=original_sr, target_sr=target_sr)
+            try:
+                # soxr's SIMD polyphase resampler is the fastest option available
+                import soxr
+                resampled_audio = soxr.resample(audio, original_sr, target_sr, quality="HQ")
+            except ImportError:
+                resampled_audio = _resample_polyphase(audio, original_sr, target_sr)
             logger.info(f"Resampled audio from {original_sr}Hz to {target_sr}Hz")
             return resampled_audio
             
@@ -156,31 +330,41 @@ class AudioPreprocessor:
             logger.error(f"Error resampling audio: {e}")
             raise
     
-    def normalize_audio(self, audio: np.ndarray, target_db: float = -20.0) -> np.ndarray:
+    def normalize_audio(self, audio: np.ndarray, target_db: float = DEFAULT_TARGET_DB,
+                        inplace: bool = False) -> np.ndarray:
         """
         Normalize audio volume to target dB level
         
         Args:
             audio: Audio array
             target_db: Target dB level for normalization
+            inplace: Write the result into audio instead of a new array
             
         Returns:
             Normalized audio array
         """
         try:
-            # Calculate current RMS
-            rms = np.sqrt(np.mean(audio**2))
-            if rms == 0:
-                return audio
-                
             # Calculate target RMS
             target_rms = 10**(target_db / 20)
             
-            # Normalize
-            normalized_audio = audio * (target_rms / rms)
-            
-            # Clip to prevent distortion
-            normalized_audio = np.clip(normalized_audio, -1.0, 1.0)
+            if _normalize_kernel is not None:
+                # Single pass: RMS, gain and clip fused in one Numba kernel
+                audio = np.ascontiguousarray(audio)
+                normalized_audio = audio if inplace else np.empty_like(audio)
+                if not _normalize_kernel(audio, normalized_audio, audio.dtype.type(target_rms)):
+                    return audio
+            else:
+                # Calculate current RMS
+                rms = _compute_rms(audio)
+                if rms == 0:
+                    return audio
+                
+                # Normalize without allocating temporaries
+                normalized_audio = audio if inplace else np.empty_like(audio)
+                np.multiply(audio, target_rms / rms, out=normalized_audio)
+                
+                # Clip to prevent distortion (direct SIMD max/min loops)
+                np.minimum(np.maximum(normalized_audio, -1.0, out=normalized_audio), 1.0, out=normalized_audio)
             
             logger.info(f"Normalized audio to {target_db}dB")
             return normalized_audio
@@ -204,14 +388,20 @@ class AudioPreprocessor:
             if not self.validate_audio_file(file_path):
                 logger.warning("Audio file validation failed, but attempting to process anyway...")
             
-            # Load audio
-            audio, original_sr = self.load_audio(file_path)
-            
-            # Resample to target sample rate
-            audio = self.resample_audio(audio, original_sr)
-            
-            # Normalize audio
-            audio = self.normalize_audio(audio)
+            try:
+                # Decode, resample and measure loudness block by block
+                audio = self.preprocess_audio_streaming(file_path)
+            except Exception as stream_error:
+                logger.warning(f"Streaming preprocessing failed, loading full file: {stream_error}")
+                
+                # Load audio
+                audio, original_sr = self.load_audio(file_path)
+                
+                # Resample to target sample rate
+                audio = self.resample_audio(audio, original_sr)
+                
+                # Normalize audio (the loaded buffer is ours, so work in place)
+                audio = self.normalize_audio(audio, inplace=True)
             
             logger.info(f"Audio preprocessing completed: shape={audio.shape}, sr={self.target_sample_rate}")
             return audio, self.target_sample_rate
@@ -220,6 +410,186 @@ class AudioPreprocessor:
             logger.error(f"Error in audio preprocessing: {e}")
             raise
     
+    def preprocess_audio_streaming(self, file_path: Union[str, BinaryIO], block_size: int = STREAM_BLOCK_SIZE,
+                                   target_db: float = DEFAULT_TARGET_DB) -> np.ndarray:
+        """
+        Two-pass streaming pipeline over soundfile blocks
+        
+        Pass 1 decodes fixed-size blocks, downmixes and resamples each one
+        into a preallocated output buffer while accumulating the sum of
+        squares. Pass 2 applies the global gain and clips in place. Peak
+        memory is the output buffer plus one block, instead of the
+        full decoded file plus resample/normalize temporaries.
+        
+        Args:
+            file_path: Path or seekable file object (any format libsndfile can read)
+            block_size: Frames decoded per block
+            target_db: Target dB level for normalization
+            
+        Returns:
+            Processed audio array at self.target_sample_rate
+        """
+        info = sf.info(file_path)
+        original_sr = info.samplerate
+        
+        resampler = None
+        if original_sr != self.target_sample_rate:
+            import soxr
+            resampler = soxr.ResampleStream(
+                original_sr, self.target_sample_rate, 1, dtype="float32", quality="HQ"
+            )
+        
+        capacity = int(math.ceil(info.frames * self.target_sample_rate / original_sr)) + block_size
+        output = np.empty(capacity, dtype=np.float32)
+        position = 0
+        sum_squares = 0.0
+        
+        def append(samples: np.ndarray) -> None:
+            nonlocal output, position, sum_squares
+            end = position + len(samples)
+            if end > len(output):
+                output = np.resize(output, end + block_size)
+            output[position:end] = samples
+            sum_squares += float(np.dot(samples, samples))
+            position = end
+        
+        # Pass 1: decode -> mono -> resample, accumulating energy
+        if hasattr(file_path, "seek"):
+            file_path.seek(0)
+        for block in sf.blocks(file_path, blocksize=block_size, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono)
+            append(mono)
+        if resampler is not None:
+            append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+        
+        audio = output[:position]
+        
+        # Pass 2: apply the global gain and clip in place
+        if position > 0 and sum_squares > 0:
+            gain = 10**(target_db / 20) / math.sqrt(sum_squares / position)
+            np.multiply(audio, gain, out=audio)
+            np.minimum(np.maximum(audio, -1.0, out=audio), 1.0, out=audio)
+        
+        logger.info(f"Streamed {info.frames} frames from {original_sr}Hz to {self.target_sample_rate}Hz")
+        return audio
+    
+    def load_audio_stream(self, file_obj: BinaryIO, format: Optional[str] = None) -> Tuple[np.ndarray, int]:
+        """
+        Load audio from an in-memory file object
+        
+        Args:
+            file_obj: Seekable file-like object (e.g. io.BytesIO of an upload)
+            format: Container format hint for pydub, e.g. "mp3" or "m4a"
+            
+        Returns:
+            Tuple of (audio_array, sample_rate)
+        """
+        try:
+            try:
+                file_obj.seek(0)
+                audio, sr = sf.read(file_obj, dtype="float32", always_2d=True)
+                audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+                logger.info(f"Loaded audio stream with soundfile: {audio.shape}, sample_rate: {sr}")
+            except Exception as sf_error:
+                logger.warning(f"Soundfile failed: {sf_error}")
+                # pydub (ffmpeg) handles the compressed containers libsndfile can't
+                from pydub import AudioSegment
+                file_obj.seek(0)
+                try:
+                    audio_segment = AudioSegment.from_file(file_obj, format=format)
+                except Exception as hinted_error:
+                    if format is None:
+                        raise
+                    # The name can lie (browser recordings are WebM/MP4 saved
+                    # as .wav); let ffmpeg sniff the container instead
+                    logger.warning(f"Decoding as {format} failed, probing container: {hinted_error}")
+                    file_obj.seek(0)
+                    audio_segment = AudioSegment.from_file(file_obj)
+                
+                audio = np.array(audio_segment.get_array_of_samples(), dtype=np.float32)
+                audio /= float(1 << (8 * audio_segment.sample_width - 1))
+                if audio_segment.channels > 1:
+                    audio = audio.reshape((-1, audio_segment.channels)).mean(axis=1)
+                
+                sr = audio_segment.frame_rate
+                logger.info(f"Loaded audio stream with pydub: {audio.shape}, sample_rate: {sr}")
+            
+            return np.ascontiguousarray(audio, dtype=np.float32), sr
+            
+        except Exception as e:
+            logger.error(f"Error loading audio stream: {e}")
+            raise
+    
+    def preprocess_audio_stream(self, file_obj: BinaryIO, format: Optional[str] = None) -> Tuple[np.ndarray, int]:
+        """
+        Complete preprocessing pipeline for in-memory audio (no temp file)
+        
+        Args:
+            file_obj: Seekable file-like object (e.g. io.BytesIO of an upload)
+            format: Container format hint for pydub, e.g. "mp3" or "m4a"
+            
+        Returns:
+            Tuple of (processed_audio, sample_rate)
+        """
+        try:
+            try:
+                audio = self.preprocess_audio_streaming(file_obj)
+            except Exception as stream_error:
+                logger.warning(f"Streaming preprocessing failed, decoding full stream: {stream_error}")
+                audio, original_sr = self.load_audio_stream(file_obj, format=format)
+                audio = self.resample_audio(audio, original_sr)
+                audio = self.normalize_audio(audio, inplace=True)
+            
+            logger.info(f"Audio stream preprocessing completed: shape={audio.shape}, sr={self.target_sample_rate}")
+            return audio, self.target_sample_rate
+            
+        except Exception as e:
+            logger.error(f"Error in audio stream preprocessing: {e}")
+            raise
+    
+    def trim_to_speech(self, audio: np.ndarray, sample_rate: int,
+                       min_speech_duration_ms: int = 250) -> Optional[np.ndarray]:
+        """
+        Detect speech with Silero VAD and trim leading/trailing silence
+        
+        Args:
+            audio: Mono audio array
+            sample_rate: Sample rate of audio
+            min_speech_duration_ms: Shortest segment counted as speech
+            
+        Returns:
+            Audio from the first to the last speech segment, None if there is
+            no speech, or the input unchanged when VAD is unavailable
+        """
+        if sample_rate not in VAD_SAMPLE_RATES or audio.size == 0:
+            return audio
+        
+        try:
+            model, get_speech_timestamps = _get_silero_vad()
+        except Exception as e:
+            logger.warning(f"Silero VAD unavailable, skipping speech detection: {e}")
+            return audio
+        
+        try:
+            import torch
+            with _VAD_LOCK:
+                speech_ts = get_speech_timestamps(
+                    torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)),
+                    model,
+                    sampling_rate=sample_rate,
+                    min_speech_duration_ms=min_speech_duration_ms
+                )
+        except Exception as e:
+            logger.warning(f"VAD failed, keeping full audio: {e}")
+            return audio
+        
+        if not speech_ts:
+            logger.info("No speech detected by VAD")
+            return None
+        return audio[speech_ts[0]["start"]:speech_ts[-1]["end"]]
+    
     def preprocess_audio_from_array(self, audio: np.ndarray, sample_rate: int) -> Tuple[np.ndarray, int]:
         """
         Preprocess audio from numpy array (for YouTube streaming)
@@ -232,11 +602,14 @@ class AudioPreprocessor:
             Tuple of (processed_audio, sample_rate)
         """
         try:
+            source = audio
+            audio = np.ascontiguousarray(audio, dtype=np.float32)
+            
             # Resample to target sample rate
             audio = self.resample_audio(audio, sample_rate)
             
-            # Normalize audio
-            audio = self.normalize_audio(audio)
+            # Normalize audio (in place unless we'd overwrite the caller's array)
+            audio = self.normalize_audio(audio, inplace=audio is not source)
             
             logger.info(f"Audio preprocessing from array completed: shape={audio.shape}, sr={self.target_sample_rate}")
             return audio, self.target_sample_rate
@@ -33,6 +33,9 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
 
+# Reuse the local model cache for HuggingFace downloads (must be set before transformers is imported)
+os.environ.setdefault("TRANSFORMERS_CACHE", MODEL_CACHE_DIR)
+
 # API settings
 API_CONFIG = {
     "host": "0.0.0.0",
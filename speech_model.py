@@ -2,8 +2,19 @@
 Speech-to-Text model module for Vietnamese
 Supports both wav2vec2 and Whisper models
 """
+import contextlib
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Import config first so the HF cache location is set before transformers loads
+from config import MODEL_CONFIGS, MODEL_CACHE_DIR
+
 import torch
 import torchaudio
+import transformers
 from transformers import (
     Wav2Vec2ForCTC, 
     Wav2Vec2Processor,
@@ -12,32 +23,346 @@ from transformers import (
 )
 import numpy as np
 import logging
-from typing import Union, Optional
+from typing import Union, Optional, List, Iterator
 import os
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Whisper's encoder window and the overlap used when stitching long-form chunks
+WHISPER_CHUNK_SECONDS = 30
+WHISPER_CHUNK_OVERLAP_SECONDS = 5
+
+# Pinned host staging buffer size (10 minutes of 16 kHz float32 audio)
+PINNED_BUFFER_SAMPLES = 16000 * 600
+
+# Exported wav2vec2 CTC graph used by the ONNX Runtime CPU path; keyed by model
+# id and library versions so a model or transformers upgrade re-exports
+WAV2VEC2_ONNX_PATH = os.path.join(
+    MODEL_CACHE_DIR,
+    "wav2vec2-{}-tf{}-torch{}.onnx".format(
+        MODEL_CONFIGS["wav2vec2"]["model_name"].replace("/", "--"),
+        transformers.__version__,
+        torch.__version__.split("+")[0]
+    )
+)
+
+# Allow TF32 tensor-core matmuls for any remaining fp32 GEMMs
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+
+# Probe the accelerator once; the answer can't change within the process
+if torch.cuda.is_available():
+    _DEFAULT_DEVICE = "cuda"
+elif torch.backends.mps.is_available():
+    _DEFAULT_DEVICE = "mps"
+else:
+    _DEFAULT_DEVICE = "cpu"
+
+def _available_cpus() -> int:
+    """
+    CPUs this process may actually use
+    
+    Honors a TORCH_NUM_THREADS override, then the cgroup v2 CPU quota, then the
+    scheduler affinity mask; os.cpu_count() reports the host's cores, which
+    oversubscribes a container limited to a fraction of them.
+    """
+    override = os.environ.get("TORCH_NUM_THREADS")
+    if override:
+        return max(1, int(override))
+    
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    
+    return cpus
+
+
+@functools.lru_cache(maxsize=1)
+def _configure_cpu_threads() -> int:
+    """Size torch's CPU thread pools once per process, on first model load"""
+    threads = _available_cpus()
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before any inter-op work has started
+        pass
+    logger.info(f"Using {threads} intra-op CPU threads")
+    return threads
+
+
+def _optimize_for_device(model, device: str):
+    """
+    Cast to bf16 and compile the forward pass on CUDA
+    
+    Args:
+        model: Loaded HF model (already on device)
+        device: Device the model lives on
+        
+    Returns:
+        The optimized model
+    """
+    if device != "cuda":
+        return model
+    
+    model = model.to(torch.bfloat16)
+    if hasattr(torch, "compile"):
+        if isinstance(model, WhisperForConditionalGeneration):
+            # Only the encoder has a fixed input shape (30 s of mel frames);
+            # generate() calls the full forward with a growing KV cache, which
+            # would recompile CUDA graphs at every new length
+            encoder = model.get_encoder()
+            encoder.forward = torch.compile(encoder.forward, mode="reduce-overhead", fullgraph=False)
+        else:
+            # CTC inputs vary in length: trace shape-polymorphic, no CUDA graphs
+            model.forward = torch.compile(model.forward, mode="default", dynamic=True, fullgraph=False)
+    return model
+
+
+def _quantize_dynamic(model, device: str, quantize: Optional[str]):
+    """
+    Dynamically quantize Linear layers to int8 on CPU
+    
+    Args:
+        model: Loaded HF model
+        device: Device the model lives on
+        quantize: "int8" to quantize, None to leave the model as is
+        
+    Returns:
+        The (possibly) quantized model
+    """
+    if quantize is None:
+        return model
+    if quantize != "int8":
+        raise ValueError(f"Unsupported quantization: {quantize}")
+    if device != "cpu":
+        # Dynamic quantized kernels are CPU-only; CUDA already runs bf16
+        logger.info(f"Skipping int8 quantization on {device}")
+        return model
+    
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _split_audio_chunks(audio: np.ndarray, sample_rate: int, chunk_seconds: float, overlap_seconds: float) -> List[np.ndarray]:
+    """
+    Split audio into fixed-length windows that overlap by overlap_seconds
+    
+    Args:
+        audio: Audio array
+        sample_rate: Sample rate of audio
+        chunk_seconds: Window length in seconds
+        overlap_seconds: Overlap between consecutive windows in seconds
+        
+    Returns:
+        List of audio chunks (views into the original array)
+    """
+    chunk_len = int(chunk_seconds * sample_rate)
+    step = chunk_len - int(overlap_seconds * sample_rate)
+    if len(audio) <= chunk_len:
+        return [audio]
+    
+    chunks = []
+    for start in range(0, len(audio), step):
+        chunks.append(audio[start:start + chunk_len])
+        if start + chunk_len >= len(audio):
+            break
+    return chunks
+
+
+def _merge_overlapping_text(texts: List[str], max_overlap_words: int = 20) -> str:
+    """
+    Join chunk transcriptions, dropping words repeated across the overlap
+    
+    Args:
+        texts: Transcriptions of consecutive overlapping chunks
+        max_overlap_words: Longest word run to consider as duplicated
+        
+    Returns:
+        Stitched transcription
+    """
+    merged: List[str] = []
+    for text in texts:
+        words = text.split()
+        limit = min(len(merged), len(words), max_overlap_words)
+        overlap = 0
+        for k in range(limit, 0, -1):
+            if [w.lower() for w in merged[-k:]] == [w.lower() for w in words[:k]]:
+                overlap = k
+                break
+        merged.extend(words[overlap:])
+    return " ".join(merged)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_wav2vec2(device: str):
+    """
+    Load (and memoize) the wav2vec2 model and processor for a device
+    
+    Args:
+        device: Requested device
+        
+    Returns:
+        Tuple of (model, processor, device) - device may fall back to CPU
+    """
+    # Load processor
+    processor = Wav2Vec2Processor.from_pretrained(
+        MODEL_CONFIGS["wav2vec2"]["processor_name"]
+    )
+    
+    # Load model
+    model = Wav2Vec2ForCTC.from_pretrained(
+        MODEL_CONFIGS["wav2vec2"]["model_name"]
+    )
+    
+    # Move to device (fallback to CPU if MPS fails)
+    try:
+        model.to(device)
+    except Exception as device_error:
+        logger.warning(f"Failed to move wav2vec2 to {device}, using CPU: {device_error}")
+        device = "cpu"
+        model.to(device)
+    
+    model.eval()
+    model = _optimize_for_device(model, device)
+    return model, processor, device
+
+
+@functools.lru_cache(maxsize=4)
+def _get_whisper(device: str, quantize: Optional[str] = None):
+    """
+    Load (and memoize) the Whisper model and processor for a device
+    
+    Args:
+        device: Requested device
+        quantize: Optional weight quantization ("int8")
+        
+    Returns:
+        Tuple of (model, processor)
+    """
+    # Load processor
+    processor = WhisperProcessor.from_pretrained(
+        MODEL_CONFIGS["whisper"]["processor_name"]
+    )
+    
+    # Load model
+    model = WhisperForConditionalGeneration.from_pretrained(
+        MODEL_CONFIGS["whisper"]["model_name"]
+    )
+    
+    # Move to device
+    model.to(device)
+    model.eval()
+    model = _quantize_dynamic(model, device, quantize)
+    model = _optimize_for_device(model, device)
+    return model, processor
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Export wrapper returning the CTC logits tensor instead of a ModelOutput"""
+    
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, input_values):
+        return self.model(input_values=input_values).logits
+
+
+# Opened ONNX Runtime session for wav2vec2; only successes are stored so a
+# transient export/session failure is retried on the next model load
+_ONNX_SESSION_CACHE = {}
+_ONNX_SESSION_LOCK = threading.Lock()
+
+
+def _get_wav2vec2_onnx_session():
+    """
+    Export the CPU wav2vec2 model to ONNX once and open an ORT session on it
+    
+    Returns:
+        onnxruntime.InferenceSession, or None if ONNX Runtime is unavailable
+        or the export fails (the failure is not memoized)
+    """
+    if ort is None:
+        return None
+    
+    with _ONNX_SESSION_LOCK:
+        session = _ONNX_SESSION_CACHE.get(WAV2VEC2_ONNX_PATH)
+        if session is None:
+            session = _create_wav2vec2_onnx_session()
+            if session is not None:
+                _ONNX_SESSION_CACHE[WAV2VEC2_ONNX_PATH] = session
+        return session
+
+
+def _create_wav2vec2_onnx_session():
+    """Export (if needed) and open the wav2vec2 ONNX session, or None on failure"""
+    try:
+        if not os.path.exists(WAV2VEC2_ONNX_PATH):
+            model, _, _ = _get_wav2vec2("cpu")
+            dummy_input_values = torch.zeros(1, 16000, dtype=torch.float32)
+            # Export next to the target and rename into place, so an
+            # interrupted export never leaves a truncated graph to be reused
+            tmp_path = f"{WAV2VEC2_ONNX_PATH}.{os.getpid()}.tmp"
+            try:
+                torch.onnx.export(
+                    _LogitsOnly(model),
+                    (dummy_input_values,),
+                    tmp_path,
+                    input_names=["input_values"],
+                    output_names=["logits"],
+                    opset_version=17,
+                    dynamic_axes={"input_values": {0: "B", 1: "T"}, "logits": {0: "B", 1: "T"}}
+                )
+                os.replace(tmp_path, WAV2VEC2_ONNX_PATH)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.info(f"Exported wav2vec2 to {WAV2VEC2_ONNX_PATH}")
+        
+        return ort.InferenceSession(WAV2VEC2_ONNX_PATH, providers=["CPUExecutionProvider"])
+        
+    except Exception as e:
+        logger.warning(f"ONNX Runtime unavailable for wav2vec2, using PyTorch: {e}")
+        return None
+
+
 class VietnameseSpeechModel:
     """Vietnamese Speech-to-Text model wrapper"""
     
-    def __init__(self, model_type: str = "wav2vec2", device: str = "auto"):
+    def __init__(self, model_type: str = "wav2vec2", device: str = "auto", quantize: Optional[str] = None):
         self.model_type = model_type
         self.device = self._get_device(device)
+        self.quantize = quantize
         self.model = None
         self.processor = None
+        _configure_cpu_threads()
         self._load_model()
         
+        # Pinned staging buffer and side stream for async host-to-device copies
+        self._pinned = None
+        self._stream = None
+        if self.device == "cuda":
+            self._pinned = torch.empty(PINNED_BUFFER_SAMPLES, dtype=torch.float32, pin_memory=True)
+            self._stream = torch.cuda.Stream()
+        
     def _get_device(self, device: str) -> str:
         """Determine the best device to use"""
-        if device == "auto":
-            if torch.cuda.is_available():
-                return "cuda"
-            elif torch.backends.mps.is_available():
-                return "mps"
-            else:
-                return "cpu"
-        return device
+        return _DEFAULT_DEVICE if device == "auto" else device
     
     def _load_model(self):
         """Load the specified model and processor"""
@@ -57,28 +382,21 @@ class VietnameseSpeechModel:
     
     def _load_wav2vec2_model(self):
         """Load wav2vec2 model for Vietnamese"""
-        model_name = "facebook/wav2vec2-base-960h"
-        
         try:
-            # Load processor
-            self.processor = Wav2Vec2Processor.from_pretrained(
-                model_name
-            )
+            self.model, self.processor, self.device = _get_wav2vec2(self.device)
             
-            # Load model
-            self.model = Wav2Vec2ForCTC.from_pretrained(
-                model_name
-            )
+            # Cache the feature-extractor settings we replicate in transcribe_wav2vec2
+            self._feature_extractor = self.processor.feature_extractor
+            self._do_normalize = self._feature_extractor.do_normalize
             
-            # Move to device (fallback to CPU if MPS fails)
-            try:
-                self.model.to(self.device)
-            except Exception as device_error:
-                logger.warning(f"Failed to move wav2vec2 to {self.device}, using CPU: {device_error}")
-                self.device = "cpu"
-                self.model.to(self.device)
+            # Token table for vectorized CTC decoding
+            tokenizer = self.processor.tokenizer
+            self._vocab = np.array(tokenizer.convert_ids_to_tokens(range(self.model.config.vocab_size)))
+            self._pad_token_id = self.model.config.pad_token_id
+            self._word_delimiter = tokenizer.word_delimiter_token
             
-            self.model.eval()
+            # ONNX Runtime fuses the fp32 CPU graph; CUDA keeps the compiled bf16 model
+            self._ort_session = _get_wav2vec2_onnx_session() if self.device == "cpu" else None
             
         except Exception as e:
             logger.error(f"Error loading wav2vec2 model: {e}")
@@ -86,21 +404,56 @@ class VietnameseSpeechModel:
         
     def _load_whisper_model(self):
         """Load Whisper model"""
-        model_name = "openai/whisper-small"
-        
-        # Load processor
-        self.processor = WhisperProcessor.from_pretrained(
-            model_name
-        )
+        self.model, self.processor = _get_whisper(self.device, self.quantize)
+    
+    def _move_inputs(self, inputs) -> dict:
+        """
+        Move processor outputs to the model device, casting features to the model dtype
         
-        # Load model
-        self.model = WhisperForConditionalGeneration.from_pretrained(
-            model_name
-        )
+        On CUDA, float features are staged through the pinned buffer so the
+        copy can run non-blocking on the side stream.
+        """
+        if self._pinned is None:
+            return {
+                k: v.to(self.device, dtype=self.model.dtype) if v.is_floating_point() else v.to(self.device)
+                for k, v in inputs.items()
+            }
         
-        # Move to device
-        self.model.to(self.device)
-        self.model.eval()
+        moved = {}
+        offset = 0
+        for k, v in inputs.items():
+            if not v.is_floating_point():
+                moved[k] = v.to(self.device, non_blocking=True)
+                continue
+            n = v.numel()
+            if offset + n > self._pinned.numel():
+                self._pinned = torch.empty(offset + n, dtype=torch.float32, pin_memory=True)
+            staged = self._pinned[offset:offset + n].view(v.shape)
+            staged.copy_(v)
+            moved[k] = staged.to(self.device, dtype=self.model.dtype, non_blocking=True)
+            offset += n
+        return moved
+    
+    @contextlib.contextmanager
+    def _device_stream(self):
+        """Run the enclosed copy + forward on the side CUDA stream (no-op elsewhere)"""
+        if self._stream is None:
+            yield
+            return
+        self._stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(self._stream):
+            yield
+        torch.cuda.current_stream().wait_stream(self._stream)
+    
+    def _ctc_ids_to_text(self, ids: np.ndarray) -> str:
+        """Map collapsed, pad-free CTC ids to text with a single vocab gather"""
+        text = "".join(self._vocab[ids]).replace(self._word_delimiter, " ")
+        return " ".join(text.split())
+    
+    def _decode_ctc_frames(self, frame_ids: np.ndarray) -> str:
+        """CTC collapse on host frame ids: keep the first of each run, then drop blanks"""
+        ids = frame_ids[np.insert(np.diff(frame_ids) != 0, 0, True)]
+        return self._ctc_ids_to_text(ids[ids != self._pad_token_id])
     
     def transcribe_wav2vec2(self, audio: np.ndarray, sample_rate: int) -> str:
         """
@@ -114,24 +467,38 @@ class VietnameseSpeechModel:
             Transcribed text
         """
         try:
-            # Process audio
-            inputs = self.processor(
-                audio, 
-                sampling_rate=sample_rate, 
-                return_tensors="pt", 
-                padding=True
-            )
+            if sample_rate != self._feature_extractor.sampling_rate:
+                raise ValueError(
+                    f"wav2vec2 expects {self._feature_extractor.sampling_rate}Hz audio, got {sample_rate}Hz"
+                )
             
-            # Move to device
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            if self._ort_session is not None:
+                input_values = np.ascontiguousarray(audio, dtype=np.float32)
+                if self._do_normalize:
+                    input_values = (input_values - input_values.mean()) / np.sqrt(input_values.var() + 1e-7)
+                logits = self._ort_session.run(None, {"input_values": input_values[np.newaxis, :]})[0]
+                
+                return self._decode_ctc_frames(logits[0].argmax(-1))
             
-            # Inference
-            with torch.no_grad():
-                logits = self.model(**inputs).logits
+            # Build the input tensor directly instead of going through the processor
+            audio_tensor = torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)).unsqueeze(0)
             
-            # Decode
-            predicted_ids = torch.argmax(logits, dim=-1)
-            transcription = self.processor.batch_decode(predicted_ids)[0]
+            # Move to device and run inference on the side stream
+            with self._device_stream(), torch.inference_mode():
+                input_values = self._move_inputs({"input_values": audio_tensor})["input_values"]
+                
+                # Zero-mean / unit-variance normalization, as the feature extractor does
+                if self._do_normalize:
+                    values = input_values.float()
+                    values = (values - values.mean()) / torch.sqrt(values.var(unbiased=False) + 1e-7)
+                    input_values = values.to(self.model.dtype)
+                
+                logits = self.model(input_values=input_values).logits
+            
+            # Decode: collapse repeats and drop blanks on-device, then gather tokens
+            ids = torch.unique_consecutive(torch.argmax(logits, dim=-1)[0])
+            ids = ids[ids != self._pad_token_id].cpu().numpy()
+            transcription = self._ctc_ids_to_text(ids)
             
             return transcription
             
@@ -139,47 +506,172 @@ class VietnameseSpeechModel:
             logger.error(f"Error in wav2vec2 transcription: {e}")
             raise
     
-    def transcribe_whisper(self, audio: np.ndarray, sample_rate: int) -> str:
+    def transcribe_whisper(self, audio: np.ndarray, sample_rate: int, high_quality: bool = False) -> str:
         """
         Transcribe audio using Whisper model
         
+        Audio longer than one Whisper window is split into overlapping
+        30-second chunks that are decoded together as a single batch.
+        
         Args:
             audio: Audio array
             sample_rate: Sample rate of audio
+            high_quality: Use 5-beam search instead of greedy decoding
             
         Returns:
             Transcribed text
         """
         try:
-            # Process audio
-            inputs = self.processor(
-                audio, 
-                sampling_rate=sample_rate, 
-                return_tensors="pt"
+            chunks = _split_audio_chunks(
+                audio, sample_rate, WHISPER_CHUNK_SECONDS, WHISPER_CHUNK_OVERLAP_SECONDS
             )
+            texts = self._generate_whisper(chunks, sample_rate, high_quality)
+            transcription = _merge_overlapping_text(texts)
             
-            # Move to device
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            return transcription
             
-            # Generate transcription
-            with torch.no_grad():
-                generated_ids = self.model.generate(
-                    inputs["input_features"],
-                    max_length=448,
-                    num_beams=5,
-                    early_stopping=True
-                )
+        except Exception as e:
+            logger.error(f"Error in Whisper transcription: {e}")
+            raise
+    
+    def _generate_whisper(self, chunks: List[np.ndarray], sample_rate: int, high_quality: bool = False) -> List[str]:
+        """
+        Decode up-to-30-second chunks with a single batched generate() call
+        
+        Args:
+            chunks: Audio chunks, each at most one Whisper window long
+            sample_rate: Sample rate of audio
+            high_quality: Use 5-beam search instead of greedy decoding
             
-            # Decode
-            transcription = self.processor.batch_decode(
-                generated_ids, 
-                skip_special_tokens=True
-            )[0]
+        Returns:
+            One transcription per chunk
+        """
+        # Process audio into a (B, 80, 3000) log-mel batch
+        inputs = self.processor(
+            chunks, 
+            sampling_rate=sample_rate, 
+            return_tensors="pt"
+        )
+        
+        # Beam search multiplies decoder cost, so only use it when asked
+        generate_kwargs = {"num_beams": 1, "do_sample": False}
+        if high_quality:
+            generate_kwargs = {"num_beams": 5, "early_stopping": True}
+        
+        # Move to device and generate transcription on the side stream
+        with self._device_stream(), torch.inference_mode(), torch.autocast(
+            device_type="cuda", dtype=torch.bfloat16, enabled=self.device == "cuda"
+        ):
+            inputs = self._move_inputs(inputs)
+            generated_ids = self.model.generate(
+                inputs["input_features"],
+                max_length=448,
+                use_cache=True,
+                **generate_kwargs
+            )
+        
+        # Decode
+        return self.processor.batch_decode(
+            generated_ids, 
+            skip_special_tokens=True
+        )
+    
+    def _transcribe_wav2vec2_batch(self, audios: List[np.ndarray], sample_rate: int) -> List[str]:
+        """
+        Transcribe several utterances with one padded wav2vec2 forward pass
+        
+        Args:
+            audios: Audio arrays
+            sample_rate: Sample rate shared by all arrays
             
-            return transcription
+        Returns:
+            One transcription per input
+        """
+        if sample_rate != self._feature_extractor.sampling_rate:
+            raise ValueError(
+                f"wav2vec2 expects {self._feature_extractor.sampling_rate}Hz audio, got {sample_rate}Hz"
+            )
+        
+        # Normalize each utterance on its own, then zero-pad into one batch
+        lengths = [len(audio) for audio in audios]
+        padded = np.zeros((len(audios), max(lengths)), dtype=np.float32)
+        attention_mask = np.zeros(padded.shape, dtype=np.int64)
+        for i, audio in enumerate(audios):
+            values = np.asarray(audio, dtype=np.float32)
+            if self._do_normalize:
+                values = (values - values.mean()) / np.sqrt(values.var() + 1e-7)
+            padded[i, :len(values)] = values
+            attention_mask[i, :len(values)] = 1
+        
+        if self._ort_session is not None:
+            frame_ids = self._ort_session.run(None, {"input_values": padded})[0].argmax(-1)
+        else:
+            inputs = {"input_values": torch.from_numpy(padded)}
+            # Base wav2vec2 checkpoints expect zero padding without a mask
+            if self._feature_extractor.return_attention_mask:
+                inputs["attention_mask"] = torch.from_numpy(attention_mask)
+            with self._device_stream(), torch.inference_mode():
+                inputs = self._move_inputs(inputs)
+                logits = self.model(**inputs).logits
+            frame_ids = torch.argmax(logits, dim=-1).cpu().numpy()
+        
+        # Split logits back per request by each utterance's valid frame count
+        output_lengths = self.model._get_feat_extract_output_lengths(torch.tensor(lengths)).tolist()
+        return [
+            self._decode_ctc_frames(row[:n])
+            for row, n in zip(frame_ids, output_lengths)
+        ]
+    
+    def _transcribe_whisper_batch(self, audios: List[np.ndarray], sample_rate: int) -> List[str]:
+        """
+        Transcribe several utterances with one batched Whisper generate() call
+        
+        Every input is split into 30-second windows and all windows from all
+        inputs are decoded together, then stitched back per input.
+        
+        Args:
+            audios: Audio arrays
+            sample_rate: Sample rate shared by all arrays
+            
+        Returns:
+            One transcription per input
+        """
+        chunks: List[np.ndarray] = []
+        spans = []
+        for audio in audios:
+            audio_chunks = _split_audio_chunks(
+                audio, sample_rate, WHISPER_CHUNK_SECONDS, WHISPER_CHUNK_OVERLAP_SECONDS
+            )
+            spans.append((len(chunks), len(chunks) + len(audio_chunks)))
+            chunks.extend(audio_chunks)
+        
+        texts = self._generate_whisper(chunks, sample_rate)
+        return [_merge_overlapping_text(texts[start:end]) for start, end in spans]
+    
+    def transcribe_batch(self, audios: List[np.ndarray], sample_rate: int) -> List[str]:
+        """
+        Transcribe several audio arrays in a single batched forward pass
+        
+        Args:
+            audios: Audio arrays
+            sample_rate: Sample rate shared by all arrays
             
+        Returns:
+            One transcription per input, in order
+        """
+        if not audios:
+            return []
+        
+        try:
+            if self.model_type == "wav2vec2":
+                return self._transcribe_wav2vec2_batch(audios, sample_rate)
+            elif self.model_type == "whisper":
+                return self._transcribe_whisper_batch(audios, sample_rate)
+            else:
+                raise ValueError(f"Unsupported model type: {self.model_type}")
+                
         except Exception as e:
-            logger.error(f"Error in Whisper transcription: {e}")
+            logger.error(f"Error in batch transcription: {e}")
             raise
     
     def transcribe(self, audio: np.ndarray, sample_rate: int) -> str:
@@ -194,12 +686,6 @@ class VietnameseSpeechModel:
             Transcribed text
         """
         try:
-            print(f"🎯 SPEECH MODEL TRANSCRIBE:")
-            print(f"📊 Audio shape: {audio.shape}")
-            print(f"🔊 Sample rate: {sample_rate}")
-            print(f"🤖 Model type: {self.model_type}")
-            print(f"💻 Device: {self.device}")
-            
             if self.model_type == "wav2vec2":
                 result = self.transcribe_wav2vec2(audio, sample_rate)
             elif self.model_type == "whisper":
@@ -207,18 +693,127 @@ class VietnameseSpeechModel:
             else:
                 raise ValueError(f"Unsupported model type: {self.model_type}")
             
-            print(f"📝 Transcription result: \"{result}\"")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "transcribe: shape=%s sr=%d type=%s device=%s result=%r",
+                    audio.shape, sample_rate, self.model_type, self.device, result
+                )
             return result
                 
         except Exception as e:
             logger.error(f"Error in transcription: {e}")
-            print(f"❌ Transcription error: {e}")
             raise
     
+    def transcribe_stream(self, audio: np.ndarray, sample_rate: int) -> Iterator[str]:
+        """
+        Transcribe audio window by window, yielding the running transcription
+        
+        Long inputs are split into the same overlapping 30-second windows as
+        transcribe_whisper(), so callers can show text before the whole file
+        has been decoded.
+        
+        Args:
+            audio: Audio array
+            sample_rate: Sample rate of audio
+            
+        Yields:
+            Cumulative transcription after each window
+        """
+        chunks = _split_audio_chunks(
+            audio, sample_rate, WHISPER_CHUNK_SECONDS, WHISPER_CHUNK_OVERLAP_SECONDS
+        )
+        texts: List[str] = []
+        for chunk in chunks:
+            if self.model_type == "wav2vec2":
+                texts.append(self.transcribe_wav2vec2(chunk, sample_rate))
+            elif self.model_type == "whisper":
+                texts.extend(self._generate_whisper([chunk], sample_rate))
+            else:
+                raise ValueError(f"Unsupported model type: {self.model_type}")
+            yield _merge_overlapping_text(texts)
+    
     def get_model_info(self) -> dict:
         """Get model information"""
         return {
             "model_type": self.model_type,
             "device": self.device,
+            "quantize": self.quantize,
             "model_name": self.model.config.name_or_path if hasattr(self.model.config, 'name_or_path') else "unknown"
         }
+
+
+class ThreadedBatchTranscriber:
+    """
+    Thread-based micro-batcher for synchronous callers (e.g. Streamlit scripts)
+    
+    Requests from concurrent threads are drained from a queue.Queue by one
+    background worker for up to max_wait_ms and dispatched as a single
+    transcribe_batch() call.
+    """
+    
+    def __init__(self, model: VietnameseSpeechModel, max_batch_size: int = 4, max_wait_ms: float = 200.0,
+                 lock: Optional[threading.Lock] = None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._lock = lock
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="batch-transcriber", daemon=True)
+        self._worker.start()
+    
+    def transcribe(self, audio: np.ndarray, sample_rate: int) -> str:
+        """
+        Queue audio for the next batch and block until its transcription is ready
+        
+        Args:
+            audio: Audio array
+            sample_rate: Sample rate of audio
+            
+        Returns:
+            Transcribed text
+        """
+        if self.max_batch_size <= 1:
+            # Batching disabled: skip the queue hop and the wait window
+            with self._lock if self._lock is not None else contextlib.nullcontext():
+                return self.model.transcribe(audio, sample_rate)
+        
+        future = Future()
+        self._queue.put((audio, sample_rate, future))
+        return future.result()
+    
+    def healthy(self) -> bool:
+        """Whether the batching worker thread is still running"""
+        return self._worker.is_alive()
+    
+    def _run(self) -> None:
+        """Collect requests into batches and dispatch them"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._process(batch)
+    
+    def _process(self, batch) -> None:
+        """Run one forward pass per sample rate in the batch and resolve the futures"""
+        by_rate = {}
+        for audio, sample_rate, future in batch:
+            by_rate.setdefault(sample_rate, []).append((audio, future))
+        
+        for sample_rate, items in by_rate.items():
+            audios = [audio for audio, _ in items]
+            try:
+                with self._lock if self._lock is not None else contextlib.nullcontext():
+                    texts = self.model.transcribe_batch(audios, sample_rate)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), text in zip(items, texts):
+                future.set_result(text)
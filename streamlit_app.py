@@ -3,20 +3,36 @@ Vietnamese Psychological Counseling App - Optimized Version
 Simplified and clean code structure
 """
 import streamlit as st
-import os
-import tempfile
 import logging
-import requests
 import io
+import gc
+import hashlib
+import html
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import re
-import base64
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List, Callable
 import time
+import random
+import numpy as np
+
+try:
+    from gtts import gTTS
+except ImportError:
+    gTTS = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Import our modules
 from audio_preprocessor import AudioPreprocessor
-from speech_model import VietnameseSpeechModel
+from speech_model import VietnameseSpeechModel, ThreadedBatchTranscriber, WHISPER_CHUNK_SECONDS
 from text_postprocessor import TextPostprocessor
+from tts_worker import TTSWorker
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +46,12 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Counseling API URL served by mock_counseling_response instead of the network
+DEMO_API_URL = "https://demo.counseling-api.com"
+
+# Accepted upload extensions -> suffix handed to the decoder
+AUDIO_SUFFIX = {'wav': '.wav', 'mp3': '.mp3', 'flac': '.flac', 'm4a': '.m4a', 'ogg': '.ogg'}
+
 # Optimized CSS - Clean and minimal
 CSS_STYLES = """
 <style>
@@ -312,213 +334,60 @@ CSS_STYLES = """
 </style>
 """
 
-# Initialize components
-@st.cache_resource
-def get_components():
-    return (
-        AudioPreprocessor(),
-        VietnameseSpeechModel(model_type="whisper"),
-        TextPostprocessor()
-    )
-
-def transcribe_audio(audio_file_path: str) -> Tuple[str, str]:
-    """Transcribe audio file"""
-    try:
-        audio_preprocessor, speech_model, text_postprocessor = get_components()
-        
-        # Preprocess audio
-        audio, sample_rate = audio_preprocessor.preprocess_audio(audio_file_path)
-        
-        if audio is None or len(audio) == 0:
-            return None, "Audio preprocessing failed"
-        
-        # Transcribe
-        transcription = speech_model.transcribe(audio, sample_rate)
-        
-        if not transcription or not transcription.strip():
-            return None, "Transcription failed"
-        
-        # Postprocess
-        final_text = text_postprocessor.postprocess(transcription)
-        
-        
-        return final_text, "Success"
-        
-    except Exception as e:
-        logger.error(f"Transcription error: {e}")
-        return None, f"Error: {str(e)}"
+# Minified once at import: strip comments and collapse whitespace so every
+# rerun ships a smaller payload
+CSS_STYLES = re.sub(r'\s+', ' ', re.sub(r'/\*.*?\*/', '', CSS_STYLES, flags=re.S)).strip()
 
+# Full-screen overlay shown while an upload is transcribed and answered
+PROCESSING_OVERLAY_HTML = '''
+<div class="processing-loading-overlay" style="z-index: 99999 !important;">
+    <div class="processing-loading-content">
+        <div class="processing-loading-spinner"></div>
+        <div style="font-size: 20px; margin-bottom: 10px; font-weight: 600;">Processing audio...</div>
+        <div style="font-size: 14px; opacity: 0.8;">Convert speech to text and generate advisory responses</div>
+    </div>
+</div>
+'''
 
+# Makes each message container look like a chat-container
+CHAT_MESSAGE_CSS = '''
+<style>
+.stContainer:has(.stChatMessage) {
+    background: #ffffff !important;
+    min-height: 60px !important;
+    padding: 15px 20px !important;
+    border-left: 1px solid #e0e0e0 !important;
+    border-right: 1px solid #e0e0e0 !important;
+    border-bottom: 1px solid #f0f0f0 !important;
+    margin-bottom: 2px !important;
+}
+.history-message {
+    display: flex; gap: 12px; align-items: flex-start;
+    background: #ffffff; min-height: 60px; padding: 15px 20px;
+    border-left: 1px solid #e0e0e0; border-right: 1px solid #e0e0e0;
+    border-bottom: 1px solid #f0f0f0; margin-bottom: 2px;
+}
+.history-avatar {font-size: 22px; line-height: 1;}
+</style>
+'''
 
+# Number of most recent messages always rendered as full chat bubbles
+# (with audio players); everything older goes into one text-only HTML block
+RICH_TAIL_MESSAGES = 2
 
-def mock_counseling_response(text: str) -> str:
-    """Mock counseling response for demo purposes"""
-    responses = [
-        "I understand your feelings. Please share more about this situation.",
-        "This seems very difficult. What methods have you tried to cope with this?",
-        "Thank you for trusting me to share. Let's explore this issue more deeply.",
-        "I can sense your anxiety. Try taking a deep breath and share more.",
-        "This is a positive step in seeking help. Please tell me more about your feelings."
-    ]
-    return responses[hash(text) % len(responses)]
-
-def call_counseling_api(text: str, api_url: str, api_key: str) -> Tuple[str, str]:
-    """Call counseling API"""
-    try:
-        # Make API call
-        headers = {"Content-Type": "application/json"}
-        data = {"query": text}
-        
-        response = requests.post(api_url, json=data, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
-        response_text = result.get("generated", "No response received")
-        
-        return response_text, "Success"
-        
-    except Exception as e:
-        logger.error(f"API call error: {e}")
-        return None, f"API Error: {str(e)}"
+# Replies inside that tail (one per user/assistant exchange) are the only ones
+# that ever show players, so only they keep their audio references
+AUDIO_REPLIES_KEPT = max(1, RICH_TAIL_MESSAGES // 2)
 
-def text_to_speech(text: str) -> Optional[bytes]:
-    """Convert text to speech using gTTS"""
-    try:
-        from gtts import gTTS
-        tts = gTTS(text=text, lang='en', slow=False)
-        audio_buffer = io.BytesIO()
-        tts.write_to_fp(audio_buffer)
-        audio_buffer.seek(0)
-        return audio_buffer.getvalue()
-    except ImportError:
-        logger.warning("gTTS not available for TTS")
-        return None
-    except Exception as e:
-        logger.error(f"TTS error: {e}")
-        return None
+# History rows sent per run; older rows are paged in on request so the
+# per-rerun payload stays bounded however long the conversation gets
+HISTORY_PAGE_MESSAGES = 40
 
-def main():
-    """Main counseling app - Optimized UI"""
-    
-    # Initialize session state
-    if 'messages' not in st.session_state:
-        st.session_state.messages = []
-    if 'api_url' not in st.session_state:
-        st.session_state.api_url = "http://localhost:8000/api/v1/rag/query"
-    if 'api_key' not in st.session_state:
-        st.session_state.api_key = "demo_key_123"
-    if 'is_processing' not in st.session_state:
-        st.session_state.is_processing = False
-    if 'processing_uploaded_audio' not in st.session_state:
-        st.session_state.processing_uploaded_audio = False
-    if 'upload_counter' not in st.session_state:
-        st.session_state.upload_counter = 0
-    if 'processing_voice_audio' not in st.session_state:
-        st.session_state.processing_voice_audio = False
-    if 'voice_upload_counter' not in st.session_state:
-        st.session_state.voice_upload_counter = 0
-    
-    # Audio processing is now handled by file uploaders only
-    
-    # Apply CSS
-    st.markdown(CSS_STYLES, unsafe_allow_html=True)
-    
-    # Main layout - Header only
-    st.markdown('''
-    <div style="display: flex; flex-direction: column; overflow: hidden;">
-        <div class="chat-title">
-            <div style="display: flex; align-items: center; gap: 12px;">
-                <span style="font-size: 24px;">🏥</span>
-                <span>AI Psychological Counseling</span>
-            </div>
-            <div style="display: flex; flex-direction: column; align-items: flex-end; font-size: 12px; line-height: 1.2;">
-                <div style="font-weight: 600; font-size: 14px;">Psychological Expert</div>
-                <div>Nguyen Minh Quang, Nguyen Ngoc Bach, Nguyen Vu Dung</div>
-            </div>
-        </div>
-    ''', unsafe_allow_html=True)
-    
-    # Display chat messages
-    
-    # Clear session button
-    if st.sidebar.button("🗑️ Clear All Messages"):
-        st.session_state.messages = []
-        st.session_state.processing_uploaded_audio = False
-        st.rerun()
-    
-    
-    # Test message display
-    if len(st.session_state.messages) == 0:
-        st.markdown("**No messages yet. Upload an audio file to start!**")
-    
-    # Display each message with structure: chat-container -> stLayoutWrapper -> stChatMessage
-    for i, message in enumerate(st.session_state.messages):
-        
-        # Create a container that will be styled as chat-container
-        with st.container():
-            # Add CSS class to this container to make it look like chat-container
-            st.markdown(f'''
-            <style>
-            .stContainer:has(.stChatMessage) {{
-                background: #ffffff !important;
-                min-height: 60px !important;
-                padding: 15px 20px !important;
-                border-left: 1px solid #e0e0e0 !important;
-                border-right: 1px solid #e0e0e0 !important;
-                border-bottom: 1px solid #f0f0f0 !important;
-                margin-bottom: 2px !important;
-            }}
-            </style>
-            ''', unsafe_allow_html=True)
-            
-            if message["role"] == "user":
-                with st.chat_message("user", avatar="👤"):
-                    st.write(message["content"])
-            else:
-                with st.chat_message("assistant", avatar="👨‍⚕️"):
-                    st.write(message["content"])
-                    
-                    # Show audio if available
-                    if "audio" in message and message["audio"]:
-                        st.audio(message["audio"], format="audio/wav")
-    
-    # Auto-scroll to bottom after displaying messages
-    st.markdown('''
-    <script>
-    // Auto-scroll to bottom of the page to show latest messages
-    setTimeout(function() {
-        window.scrollTo({
-            top: document.body.scrollHeight,
-            behavior: 'smooth'
-        });
-    }, 100);
-    </script>
-    ''', unsafe_allow_html=True)
-    
-    # Processing Loading Overlay - Show at the very end to ensure it's on top
-    if st.session_state.is_processing:
-        st.markdown('''
-        <div class="processing-loading-overlay" style="z-index: 99999 !important;">
-            <div class="processing-loading-content">
-                <div class="processing-loading-spinner"></div>
-                <div style="font-size: 20px; margin-bottom: 10px; font-weight: 600;">Processing audio...</div>
-                <div style="font-size: 14px; opacity: 0.8;">Convert speech to text and generate advisory responses</div>
-            </div>
-        </div>
-        ''', unsafe_allow_html=True)
-    
-    
-    # Independent Voice Chat Button (positioned separately like file uploader)
-    st.markdown('''
-        <div class="voice-chat-container">
-            <button class="voice-chat-button" id="voiceChatBtn">Voice Chat</button>
-        </div>
-    ''', unsafe_allow_html=True)
-    
-    
-    # JavaScript for file upload using components.v1.html
-    st.components.v1.html('''
-    <script>
+# Voice recording / upload bridge. Kept as one constant string (and still
+# emitted each run) so Streamlit's frontend sees an identical component and
+# doesn't remount it; skipping the call would remove the element instead.
+VOICE_RECORDER_JS = '''
+<script>
     function showLoadingScreen() {
         // Create loading overlay
         const loadingOverlay = document.createElement('div');
@@ -720,168 +589,891 @@ def main():
         }
     });
     
-    // Listen for audio upload messages
-    window.addEventListener('message', function(event) {
-        if (event && event.data && event.data.type === 'streamlit:audioUpload') {
-            // LOG AUDIO CONTENT (TEXT TRANSCRIPTION) - Client side
-            // The audio data will be processed by Python side
+    
+    // Play a reply's sentence chunks back to back: when one player ends, start
+    // the next one in the same chat bubble. 'ended' doesn't bubble, so listen
+    // in the capture phase; the parent flag keeps remounts from double-binding.
+    try {
+        const parentWin = window.parent;
+        if (parentWin && !parentWin.__stChainedAudio) {
+            parentWin.__stChainedAudio = true;
+            parentWin.document.addEventListener('ended', function(event) {
+                const audio = event.target;
+                if (!audio || audio.tagName !== 'AUDIO') return;
+                const bubble = audio.closest('[data-testid="stChatMessage"]');
+                if (!bubble) return;
+                const players = Array.from(bubble.querySelectorAll('audio'));
+                const next = players[players.indexOf(audio) + 1];
+                if (next) next.play();
+            }, true);
         }
-    });
+    } catch (err) {
+        // Ignore cross-origin/sandbox errors
+    }
     
+    // Bind the voice button whenever the parent DOM changes instead of polling.
+    // The observer stays connected because Streamlit may replace the button on
+    // rerun; the dataset flag keeps each node from being bound twice. While the
+    // bound node is still in the page, mutations return before any DOM lookup.
+    let boundVoiceChatBtn = null;
+    function bindVoiceChatButton(parentDoc) {
+        if (boundVoiceChatBtn && boundVoiceChatBtn.isConnected) return;
+        const voiceChatBtn = parentDoc.getElementById('voiceChatBtn');
+        if (voiceChatBtn && !voiceChatBtn.dataset.stBound) {
+            voiceChatBtn.onclick = function() {
+                startVoiceRecording();
+            };
+            voiceChatBtn.dataset.stBound = '1';
+        }
+        boundVoiceChatBtn = voiceChatBtn;
+    }
     
-    // Robustly (re)attach handlers to parent DOM elements
-    const ATTACH_INTERVAL_MS = 500;
-    const attachTimer = setInterval(function() {
-        try {
-            const parentDoc = window.parent && window.parent.document ? window.parent.document : null;
-            if (!parentDoc) return;
-            
-            
-            const voiceChatBtn = parentDoc.getElementById('voiceChatBtn');
-            if (voiceChatBtn && !voiceChatBtn.dataset.stBound) {
-                voiceChatBtn.onclick = function() {
-                    startVoiceRecording();
-                };
-                voiceChatBtn.dataset.stBound = '1';
-            }
-        } catch (err) {
-            // Ignore binding errors (e.g., cross-origin/sandbox), will retry
+    try {
+        const parentDoc = window.parent && window.parent.document ? window.parent.document : null;
+        if (parentDoc) {
+            bindVoiceChatButton(parentDoc);
+            new MutationObserver(function() {
+                bindVoiceChatButton(parentDoc);
+            }).observe(parentDoc.body, { childList: true, subtree: true });
         }
-    }, ATTACH_INTERVAL_MS);
+    } catch (err) {
+        // Ignore binding errors (e.g., cross-origin/sandbox)
+    }
     </script>
-    ''', height=0)
+'''
+
+# Initialize components
+@st.cache_resource
+def get_components():
+    audio_preprocessor = AudioPreprocessor()
+    speech_model = VietnameseSpeechModel(model_type="whisper", quantize="int8")
     
+    # Warm up on the first page load so weight loading, CUDA context init and
+    # compilation (and the VAD download) don't land on the user's first recording
+    try:
+        speech_model.transcribe(np.zeros(16000, dtype=np.float32), 16000)
+        audio_preprocessor.trim_to_speech(np.zeros(16000, dtype=np.float32), 16000)
+    except Exception as e:
+        logger.warning(f"Speech model warmup failed: {e}")
+    
+    return (
+        audio_preprocessor,
+        speech_model,
+        TextPostprocessor()
+    )
 
-    # File uploader for audio files - Now integrated into footer
-    uploaded_audio = st.file_uploader(
+@st.cache_resource
+def start_model_warmup() -> threading.Thread:
+    """Load the models in the background once per process, so the first page
+    view returns immediately and the first recording finds them warm"""
+    thread = threading.Thread(target=get_components, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# Sentence chunks synthesized concurrently per reply
+TTS_MAX_PARALLEL = 8
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """Shared background pool for work that can overlap the script thread (e.g. TTS)"""
+    return ThreadPoolExecutor(max_workers=TTS_MAX_PARALLEL, thread_name_prefix="stt-worker")
+
+@st.cache_resource(validate=lambda worker: worker.healthy())
+def get_tts_worker() -> TTSWorker:
+    """Process-wide TTS worker shared by all sessions"""
+    return TTSWorker(text_to_speech, executor=get_executor(), max_batch_size=TTS_MAX_PARALLEL)
+
+@st.cache_resource
+def get_inference_lock() -> threading.Lock:
+    """Process-wide lock serializing model inference across sessions"""
+    return threading.Lock()
+
+# Uploads arriving within this window (e.g. from several tabs) share one
+# forward pass; the window is short because a lone upload waits it out too
+MAX_BATCH_SIZE = 8
+BATCH_WINDOW_MS = 50
+
+@st.cache_resource(validate=lambda batcher: batcher.healthy())
+def get_batch_transcriber() -> ThreadedBatchTranscriber:
+    """Process-wide micro-batcher in front of the shared speech model"""
+    _, speech_model, _ = get_components()
+    return ThreadedBatchTranscriber(
+        speech_model,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=BATCH_WINDOW_MS,
+        lock=get_inference_lock()
+    )
+
+def transcribe_audio(audio_file_path: str) -> Tuple[str, str]:
+    """Transcribe an audio file on disk (thin wrapper over transcribe_audio_bytes)"""
+    try:
+        with open(audio_file_path, 'rb') as f:
+            audio_bytes = f.read()
+    except OSError as e:
+        logger.error(f"Transcription error: {e}")
+        return None, f"Error: {str(e)}"
+    
+    return transcribe_audio_bytes(audio_bytes, audio_suffix(audio_file_path))
+
+
+# (minute since epoch, "%H:%M" string) of the last formatted timestamp
+_timestamp_cache = [-1, ""]
+
+def current_timestamp() -> str:
+    """Message timestamp as HH:MM, reformatted only when the minute changes"""
+    now = time.time()
+    minute = int(now // 60)
+    if minute != _timestamp_cache[0]:
+        _timestamp_cache[0] = minute
+        _timestamp_cache[1] = time.strftime("%H:%M", time.localtime(now))
+    return _timestamp_cache[1]
+
+
+def audio_suffix(file_name: str) -> str:
+    """Suffix for an uploaded file name, looked up in AUDIO_SUFFIX"""
+    return AUDIO_SUFFIX.get(file_name.rpartition('.')[-1].lower(), '')
+
+
+class TranscriptionError(Exception):
+    """Pipeline produced no usable text; the message is shown to the user as-is"""
+
+
+# Transcripts are kept in memory only (never persisted: these are counseling
+# conversations), bounded and expired
+TRANSCRIPT_CACHE_MAX_ENTRIES = 256
+TRANSCRIPT_CACHE_TTL_S = 3600.0
+
+@st.cache_resource
+def get_transcript_cache() -> dict:
+    """Process-wide transcript cache: content digest -> [stored_at, text, sessions using it]"""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+
+def _lookup_transcript(audio_digest: str, claim: bool = False) -> Optional[str]:
+    """
+    Cached transcript for an audio digest
+    
+    Args:
+        audio_digest: Content digest of the audio
+        claim: Count the calling session as a user of the entry on a hit
+        
+    Returns:
+        Transcript, or None if missing or expired
+    """
+    cache = get_transcript_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(audio_digest)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > TRANSCRIPT_CACHE_TTL_S:
+            del cache["entries"][audio_digest]
+            return None
+        cache["entries"].move_to_end(audio_digest)
+        if claim:
+            entry[2] += 1
+        return entry[1]
+
+
+def _store_transcript(audio_digest: str, text: str) -> None:
+    """Cache a transcript for the calling session, evicting the least recently used entries past the limit"""
+    cache = get_transcript_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(audio_digest)
+        if entry is not None:
+            # Another session stored the same audio concurrently; share it
+            entry[2] += 1
+        else:
+            cache["entries"][audio_digest] = [time.monotonic(), text, 1]
+        cache["entries"].move_to_end(audio_digest)
+        while len(cache["entries"]) > TRANSCRIPT_CACHE_MAX_ENTRIES:
+            cache["entries"].popitem(last=False)
+
+
+def forget_transcripts(audio_digests) -> None:
+    """
+    Release a session's transcripts (e.g. when a user clears their chat)
+    
+    An entry is dropped once no session that used it still holds it, so one
+    user's clear doesn't evict a transcript another session is using.
+    """
+    cache = get_transcript_cache()
+    with cache["lock"]:
+        for audio_digest in audio_digests:
+            entry = cache["entries"].get(audio_digest)
+            if entry is None:
+                continue
+            entry[2] -= 1
+            if entry[2] <= 0:
+                del cache["entries"][audio_digest]
+
+
+def transcribe_audio_bytes(audio_bytes: bytes, suffix: str = "", placeholder=None) -> Tuple[str, str]:
+    """Transcribe in-memory audio bytes (e.g. an upload) without touching disk (long audio streams partial text into placeholder)"""
+    try:
+        # Repeat uploads of the same audio are served from the in-memory cache
+        audio_digest = hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
+        # Each session counts once per entry, so clearing the chat releases
+        # exactly the references this session took
+        held = st.session_state.setdefault('transcript_digests', set())
+        claim = audio_digest not in held
+        transcription = _lookup_transcript(audio_digest, claim=claim)
+        if transcription is None:
+            transcription = _transcribe_bytes(audio_bytes, suffix, placeholder)
+            _store_transcript(audio_digest, transcription)
+        held.add(audio_digest)
+        return transcription, "Success"
+        
+    except TranscriptionError as e:
+        return None, str(e)
+    except Exception as e:
+        logger.error(f"Transcription error: {e}")
+        return None, f"Error: {str(e)}"
+
+
+def _transcribe_bytes(audio_bytes: bytes, suffix: str, placeholder=None) -> str:
+    """Preprocess, transcribe and postprocess audio bytes (errors raise so they aren't cached)"""
+    audio_preprocessor, speech_model, text_postprocessor = get_components()
+    
+    # Preprocess audio straight from memory
+    audio, sample_rate = audio_preprocessor.preprocess_audio_stream(
+        io.BytesIO(audio_bytes), format=suffix.lstrip(".").lower() or None
+    )
+    return _run_transcription(audio, sample_rate, placeholder)
+
+
+def _run_transcription(audio, sample_rate: int, placeholder=None) -> str:
+    """Transcribe + postprocess preprocessed audio, raising TranscriptionError on empty results"""
+    audio_preprocessor, speech_model, text_postprocessor = get_components()
+    
+    if audio is None or len(audio) == 0:
+        raise TranscriptionError("Audio preprocessing failed")
+    
+    # Skip ASR (and the API/TTS that follow) for silent recordings, and
+    # don't spend inference on leading/trailing silence
+    audio = audio_preprocessor.trim_to_speech(audio, sample_rate)
+    if audio is None:
+        raise TranscriptionError("No speech detected")
+    
+    if placeholder is not None and len(audio) > WHISPER_CHUNK_SECONDS * sample_rate:
+        # Long audio: show the running transcript window by window
+        transcription = ""
+        with get_inference_lock():
+            for transcription in speech_model.transcribe_stream(audio, sample_rate):
+                placeholder.markdown(transcription)
+        placeholder.empty()
+    else:
+        # Transcribe (batched with concurrent uploads; pre/postprocessing stay concurrent)
+        transcription = get_batch_transcriber().transcribe(audio, sample_rate)
+    
+    if not transcription or not transcription.strip():
+        raise TranscriptionError("Transcription failed")
+    
+    # Postprocess
+    return text_postprocessor.postprocess(transcription)
+
+
+
+
+def _show_earlier_history() -> None:
+    """Button callback: page one more batch of history rows in"""
+    st.session_state.history_window = st.session_state.get('history_window', HISTORY_PAGE_MESSAGES) + HISTORY_PAGE_MESSAGES
+
+
+@st.fragment
+def render_history() -> None:
+    """
+    Collapsed chat history: the newest history_window rows as one HTML block
+    
+    Paging earlier rows in reruns only this fragment. The joined block is
+    rebuilt only when the row count or window changes.
+    """
+    parts = st.session_state.get('history_parts', [])
+    window = st.session_state.get('history_window', HISTORY_PAGE_MESSAGES)
+    if len(parts) > window:
+        st.button(
+            f"Show earlier messages ({len(parts) - window} hidden)",
+            key="show_earlier_history",
+            on_click=_show_earlier_history
+        )
+    
+    block_key = (len(parts), window)
+    if st.session_state.get('history_block_key') != block_key:
+        st.session_state.history_block = "".join(parts[-window:])
+        st.session_state.history_block_key = block_key
+    st.markdown(st.session_state.history_block, unsafe_allow_html=True)
+
+
+def history_message_html(message: dict) -> str:
+    """Static HTML row for a message in the collapsed chat history"""
+    avatar = "👤" if message["role"] == "user" else "👨‍⚕️"
+    return (
+        f'<div class="history-message"><span class="history-avatar">{avatar}</span>'
+        f'<div>{html.escape(message["content"])}</div></div>'
+    )
+
+
+def render_audio_uploader(slot):
+    """File uploader for audio files, keyed by upload_counter so bumping it resets the widget"""
+    return slot.file_uploader(
         "Upload Audio File", 
-        type=['wav', 'mp3', 'flac', 'm4a', 'ogg'], 
+        type=list(AUDIO_SUFFIX), 
         key=f"audio_uploader_{st.session_state.get('upload_counter', 0)}",
         help="Limit 50MB per file • WAV, MP3, M4A, FLAC, OGG",
         label_visibility="collapsed"
     )
-    
-    
-    # VOICE RECORDING: Hidden file uploader for voice data
-    voice_audio_file = st.file_uploader(
+
+
+def render_voice_uploader(slot):
+    """Hidden file uploader the recorder JS feeds, keyed by voice_upload_counter"""
+    return slot.file_uploader(
         "Voice Recording", 
-        type=['wav', 'mp3', 'm4a', 'flac', 'ogg'], 
+        type=list(AUDIO_SUFFIX), 
         key=f"voice_recording_uploader_{st.session_state.get('voice_upload_counter', 0)}",
         help=None,
         label_visibility="collapsed"
     )
-    
-    
 
-    
-    # Audio processing is now handled by file uploaders only
-    
-    # VOICE RECORDING: Process voice audio file (only if not processing other audio)
-    if voice_audio_file and not st.session_state.get('processing_voice_audio', False) and not st.session_state.get('processing_uploaded_audio', False):
-        st.session_state.processing_voice_audio = True
-        st.session_state.is_processing = True  # Show loading immediately
-        st.rerun()  # Force refresh to show loading overlay
-    elif st.session_state.get('processing_voice_audio', False):
-        
-        # Check file size before processing
-        max_size_mb = 50
-        if voice_audio_file.size > max_size_mb * 1024 * 1024:
-            st.error(f"Voice file too large. Max size: {max_size_mb}MB")
-            st.session_state.processing_voice_audio = False
-            st.session_state.is_processing = False  # Hide loading on error
-            st.rerun()
+
+# Uploads above this size trigger an explicit collection once released
+GC_UPLOAD_THRESHOLD_BYTES = 10 * 1024 * 1024
+
+def release_upload(uploaded_file, widget_key: str) -> None:
+    """Close a processed upload and drop its widget state so the payload can be freed"""
+    size = uploaded_file.size
+    uploaded_file.close()
+    st.session_state.pop(widget_key, None)
+    if size > GC_UPLOAD_THRESHOLD_BYTES:
+        gc.collect()
+
+
+def render_message(message: dict) -> None:
+    """Render one message as a chat bubble"""
+    # Create a container that will be styled as chat-container
+    with st.container():
+        if message["role"] == "user":
+            with st.chat_message("user", avatar="👤"):
+                st.write(message["content"])
+        else:
+            with st.chat_message("assistant", avatar="👨‍⚕️"):
+                st.write(message["content"])
+                
+                # Show audio if available (one player per sentence chunk)
+                render_reply_audio(message)
+
+
+def show_new_messages(chat_container, empty_notice, start: int) -> None:
+    """Append messages added during this run to the already-rendered chat"""
+    new_messages = st.session_state.messages[start:]
+    if not new_messages:
+        return
+    empty_notice.empty()
+    with chat_container:
+        for message in new_messages:
+            render_message(message)
+
+
+def render_reply_audio(message: dict) -> None:
+    """Audio players for a reply, polled as a fragment while synthesis is pending"""
+    tts_worker = get_tts_worker()
+    pending = any(tts_worker.is_pending(request_id) for request_id in message.get("audio_requests", []))
+    st.fragment(_reply_audio_players, run_every=0.5 if pending else None)(message, pending)
+
+
+def _reply_audio_players(message: dict, polling: bool = False) -> None:
+    """Render one player per synthesized sentence chunk, as soon as the chunks before it are ready"""
+    tts_worker = get_tts_worker()
+    for request_id, text in zip(message.get("audio_requests", []), message.get("audio_text", [])):
+        # Stop at the first pending chunk so the players stay in reply order;
+        # the first sentence can play while the rest are still synthesizing
+        if tts_worker.is_pending(request_id):
+            st.caption("🔊 Preparing audio...")
             return
         
-        with tempfile.NamedTemporaryFile(delete=True, suffix=os.path.splitext(voice_audio_file.name)[1]) as temp_file:
-            temp_file.write(voice_audio_file.read())
-            temp_file.flush()
+        if tts_worker.failed(request_id):
+            # Failures aren't cached, so don't retry gTTS on every tick
+            st.caption("🔇 Audio unavailable")
+            continue
+        
+        # Fall back to the TTS cache if the worker result was evicted
+        audio = tts_worker.poll(request_id) or (None if polling else text_to_speech(text))
+        if audio:
+            st.audio(audio, format="audio/mpeg")
+    
+    if polling:
+        # This is an app-wide rerun, paid once per reply. run_every is fixed
+        # when the fragment is registered by a full script run; a
+        # scope="fragment" rerun would keep the 0.5 s timer, so only a full
+        # run can re-register this fragment without polling
+        st.rerun()
+
+
+AUDIO_KEYS = ("audio", "audio_text", "audio_requests")
+
+def prune_audio(messages: List[dict], keep_last: int = AUDIO_REPLIES_KEPT) -> None:
+    """Drop audio references from all but the last keep_last replies"""
+    kept = 0
+    for message in reversed(messages):
+        if not any(key in message for key in AUDIO_KEYS):
+            continue
+        if kept < keep_last:
+            kept += 1
+            continue
+        for key in AUDIO_KEYS:
+            message.pop(key, None)
+
+
+# Canned replies used when no real counseling backend is configured
+MOCK_RESPONSES = (
+    "I understand your feelings. Please share more about this situation.",
+    "This seems very difficult. What methods have you tried to cope with this?",
+    "Thank you for trusting me to share. Let's explore this issue more deeply.",
+    "I can sense your anxiety. Try taking a deep breath and share more.",
+    "This is a positive step in seeking help. Please tell me more about your feelings."
+)
+
+def mock_counseling_response(text: str) -> str:
+    """Mock counseling response for demo purposes"""
+    # Rotate by conversation position: O(1), deterministic, no bytes hashed
+    return MOCK_RESPONSES[len(st.session_state.get('messages', [])) % len(MOCK_RESPONSES)]
+
+@st.cache_resource
+def get_http_session() -> "requests.Session":
+    """Shared HTTP session so API calls reuse pooled keep-alive connections"""
+    # requests is only needed once a real backend is called, not in demo mode
+    import requests
+    from requests.adapters import HTTPAdapter
+    
+    session = requests.Session()
+    # Connection-level headers live on the session instead of every call
+    session.headers.update({"Connection": "keep-alive", "Content-Type": "application/json"})
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def call_counseling_api(text: str, api_url: str, api_key: str,
+                        on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+    """Call counseling API (demo/empty URL is answered by the mock)
+    
+    on_delta, if given, receives the reply-so-far while a streaming
+    (non-JSON) backend response is still arriving.
+    """
+    if not api_url or api_url == DEMO_API_URL:
+        return mock_counseling_response(text), "Success"
+    return _call_real_api(text, api_url, api_key, on_delta)
+
+# Transient API failures are retried after 0.1 s, 0.4 s and 1.6 s (plus jitter);
+# after API_BREAKER_THRESHOLD consecutive failed calls the backend is skipped
+# for API_BREAKER_COOLDOWN_S so a down server fails fast
+API_MAX_ATTEMPTS = 3
+API_BACKOFF_BASE_S = 0.1
+API_BREAKER_THRESHOLD = 5
+API_BREAKER_COOLDOWN_S = 30.0
+
+@st.cache_resource
+def get_api_breaker() -> dict:
+    """Process-wide circuit breaker state for the counseling backend"""
+    return {"lock": threading.Lock(), "failures": 0, "open_until": 0.0}
+
+def prewarm_api_connection(api_url: str) -> None:
+    """Open (or refresh) a pooled connection to the backend so the real call skips the TCP/TLS handshake"""
+    if not api_url or api_url == DEMO_API_URL:
+        return
+    try:
+        # Any status is fine; only the pooled keep-alive connection matters
+        get_http_session().head(api_url, timeout=5)
+    except Exception as e:
+        logger.debug(f"API prewarm failed: {e}")
+
+def _call_real_api(text: str, api_url: str, api_key: str,
+                   on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+    """POST the query to the counseling backend, retrying transient failures"""
+    import requests
+    
+    breaker = get_api_breaker()
+    if time.monotonic() < breaker["open_until"]:
+        return None, "API Error: service unavailable, please try again shortly"
+    
+    # Make API call (body encoded once and reused across retries; the
+    # session already sends Content-Type: application/json)
+    data = {"query": text}
+    body = orjson.dumps(data) if orjson is not None else json.dumps(data).encode("utf-8")
+    
+    for attempt in range(API_MAX_ATTEMPTS):
+        try:
+            with get_http_session().post(api_url, data=body, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                
+                if response.headers.get("Content-Type", "").startswith("application/json"):
+                    result = orjson.loads(response.content) if orjson is not None else response.json()
+                    response_text = result.get("generated", "No response received")
+                else:
+                    # Streaming backend: surface the reply as it arrives
+                    response.encoding = response.encoding or "utf-8"
+                    response_text = ""
+                    for delta in response.iter_content(chunk_size=None, decode_unicode=True):
+                        response_text += delta
+                        if on_delta is not None:
+                            on_delta(response_text)
             
-            transcription, status = transcribe_audio(temp_file.name)
+            with breaker["lock"]:
+                breaker["failures"] = 0
+            return response_text, "Success"
             
-            if transcription:
-                # Add transcription as user message
-                st.session_state.messages.append({
-                    "role": "user", 
-                    "content": transcription,
-                    "timestamp": time.strftime("%H:%M")
-                })
-                # Call AI API for response
-                response, status = call_counseling_api(
-                    transcription, 
-                    st.session_state.api_url, 
-                    st.session_state.api_key
-                )
-                if response:
-                    audio_data = text_to_speech(response)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response,
-                        "timestamp": time.strftime("%H:%M"),
-                        "audio": audio_data
-                    })
-                else:
-                    st.error(status)
-            else:
-                st.error(status)
-        
-        st.session_state.is_processing = False
-        st.session_state.processing_voice_audio = False
-        
-        # Reset voice file uploader to prevent loop
-        st.session_state.voice_upload_counter = st.session_state.get('voice_upload_counter', 0) + 1
-        st.rerun()  # Refresh frontend to hide loading overlay
-    
-    
-    # Process uploaded audio file with better error handling (only if not processing voice audio)
-    if uploaded_audio and not st.session_state.get('processing_uploaded_audio', False) and not st.session_state.get('processing_voice_audio', False):
-        st.session_state.processing_uploaded_audio = True
-        st.session_state.is_processing = True  # Show loading immediately
-        st.rerun()  # Force refresh to show loading overlay
-    elif st.session_state.get('processing_uploaded_audio', False):
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt + 1 < API_MAX_ATTEMPTS:
+                delay = API_BACKOFF_BASE_S * 4 ** attempt
+                logger.warning(f"API call failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay * (1 + random.random() * 0.25))
+                continue
+            error = e
+        except (requests.RequestException, ValueError) as e:
+            # ValueError covers a non-JSON response body
+            error = e
+        break
+    
+    with breaker["lock"]:
+        breaker["failures"] += 1
+        if breaker["failures"] >= API_BREAKER_THRESHOLD:
+            breaker["open_until"] = time.monotonic() + API_BREAKER_COOLDOWN_S
+    logger.error(f"API call error: {error}")
+    return None, f"API Error: {error}"
+
+@st.cache_data(max_entries=512, ttl=3600, show_spinner=False)
+def _synthesize_speech(text: str, lang: str, slow: bool) -> bytes:
+    """Synthesize speech with gTTS (cached across reruns; errors raise so they aren't cached)"""
+    if gTTS is None:
+        raise ImportError("gTTS is not installed")
+    tts = gTTS(text=text, lang=lang, slow=slow)
+    # Join the MP3 chunks directly instead of going through a BytesIO copy
+    return b"".join(tts.stream())
+
+# Clause/sentence boundaries; CJK punctuation isn't followed by a space
+_SENTENCE_END = re.compile(r'(?<=[.!?,;])\s+|(?<=[。，])\s*')
+
+# Fragments shorter than this are merged into their neighbour so tiny
+# clauses don't each cost a TTS round-trip
+MIN_TTS_CHUNK_CHARS = 40
+
+def split_sentences(text: str) -> List[str]:
+    """Split text at punctuation into TTS chunks of at least MIN_TTS_CHUNK_CHARS"""
+    chunks = []
+    current = ""
+    for fragment in _SENTENCE_END.split(text.strip()):
+        if not fragment:
+            continue
+        current = f"{current} {fragment}" if current else fragment
+        if len(current) >= MIN_TTS_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+    if current:
+        if chunks:
+            chunks[-1] = f"{chunks[-1]} {current}"
+        else:
+            chunks.append(current)
+    return chunks
+
+def prefetching_reply_stream(slot, tts_worker: TTSWorker) -> Callable[[str], None]:
+    """
+    on_delta callback for call_counseling_api that shows the partial reply
+    and queues TTS for each chunk as soon as it is complete
+    
+    Args:
+        slot: st.empty() placeholder to render the partial reply into
+        tts_worker: Worker the finished chunks are submitted to
         
+    Returns:
+        Callback taking the reply-so-far
+    """
+    submitted = set()
+    
+    def on_delta(partial: str) -> None:
+        slot.markdown(partial)
+        # Every chunk but the last is built from finished sentences, so it
+        # matches what split_sentences() yields for the full reply; the
+        # final submit then joins the in-flight request or hits the cache
+        for chunk in split_sentences(partial)[:-1]:
+            if chunk not in submitted:
+                submitted.add(chunk)
+                tts_worker.submit(chunk)
+    
+    return on_delta
+
+def text_to_speech(text: str, lang: str = 'en', slow: bool = False) -> Optional[bytes]:
+    """Convert text to speech using gTTS"""
+    try:
+        # Collapse whitespace so trivially different chunks share a cache entry
+        return _synthesize_speech(" ".join(text.split()), lang, slow)
+    except ImportError:
+        logger.warning("gTTS not available for TTS")
+        return None
+    except Exception as e:
+        logger.error(f"TTS error: {e}")
+        return None
+
+def upload_digest(upload, widget_key: str) -> str:
+    """Identity of an upload for dedup: its uploader key plus a blake2b hash of the bytes (no copy)"""
+    return f"{widget_key}:{hashlib.blake2b(upload.getbuffer(), digest_size=8).hexdigest()}"
+
+
+def _handle_audio_upload(upload, audio_hash: str, flag_key: str, counter_key: str, key_prefix: str, label: str,
+                         slot, render_uploader: Callable, overlay_slot, chat_container, empty_notice) -> None:
+    """
+    Run one chat turn for an uploaded or recorded audio file
+    
+    Args:
+        upload: UploadedFile to process
+        audio_hash: upload_digest() of the upload, recorded once the turn ends
+        flag_key: Session flag marking this source as processing
+        counter_key: Session counter keying this source's uploader widget
+        key_prefix: Uploader widget key prefix (the counter is appended)
+        label: Name used in the size error, e.g. "Voice file"
+        slot: Placeholder holding the uploader
+        render_uploader: Renders the uploader into slot under the current counter
+        overlay_slot: Placeholder holding the processing overlay
+        chat_container: Container new messages are written into
+        empty_notice: "No messages yet" placeholder to clear
+    """
+    try:
         # Check file size before processing
         max_size_mb = 50
-        if uploaded_audio.size > max_size_mb * 1024 * 1024:
-            st.error(f"File too large. Max size: {max_size_mb}MB")
-            st.session_state.processing_uploaded_audio = False
-            st.session_state.is_processing = False  # Hide loading on error
-            st.rerun()
+        if upload.size > max_size_mb * 1024 * 1024:
+            st.error(f"{label} too large. Max size: {max_size_mb}MB")
+            st.session_state[flag_key] = False
+            st.session_state.is_processing = False
+            # Hide loading and reset the uploader in place
+            overlay_slot.empty()
+            release_upload(upload, f"{key_prefix}{st.session_state[counter_key]}")
+            st.session_state[counter_key] += 1
+            render_uploader(slot)
             return
         
-        with tempfile.NamedTemporaryFile(delete=True, suffix=os.path.splitext(uploaded_audio.name)[1]) as temp_file:
-            temp_file.write(uploaded_audio.read())
-            temp_file.flush()
-            transcription, status = transcribe_audio(temp_file.name)
+        turn_start = len(st.session_state.messages)
+        
+        # Warm the API connection while speech-to-text runs
+        get_executor().submit(prewarm_api_connection, st.session_state.api_url)
+        
+        # Decode straight from the in-memory upload, no temp file round-trip
+        transcription, status = transcribe_audio_bytes(
+            upload.getvalue(), audio_suffix(upload.name), placeholder=chat_container.empty()
+        )
+        # Free the upload now rather than holding it for the rest of the turn
+        release_upload(upload, f"{key_prefix}{st.session_state[counter_key]}")
+        
+        if transcription:
+            # One timestamp for the whole turn
+            ts = current_timestamp()
             
-            if transcription:
-                # Add transcription as user message
+            # Add transcription as user message
+            st.session_state.messages.append({
+                "role": "user", 
+                "content": transcription,
+                "timestamp": ts
+            })
+            
+            # Call AI API for response, showing streamed text as it arrives
+            # and starting TTS on finished sentences before the reply ends
+            tts_worker = get_tts_worker()
+            stream_slot = chat_container.empty()
+            response, status = call_counseling_api(
+                transcription, st.session_state.api_url, st.session_state.api_key,
+                on_delta=prefetching_reply_stream(stream_slot, tts_worker)
+            )
+            stream_slot.empty()
+            if response:
+                # Queue synthesis on the shared TTS worker and return right
+                # away; the reply's audio players poll it until ready. Session
+                # state keeps only sentence texts and request ids
+                audio_text = split_sentences(response)
                 st.session_state.messages.append({
-                    "role": "user", 
-                    "content": transcription,
-                    "timestamp": time.strftime("%H:%M")
+                    "role": "assistant", 
+                    "content": response,
+                    "timestamp": ts,
+                    "audio_text": audio_text,
+                    "audio_requests": [tts_worker.submit(text) for text in audio_text]
                 })
-                
-                # Call AI API for response
-                response, status = call_counseling_api(transcription, st.session_state.api_url, st.session_state.api_key)
-                if response:
-                    audio_data = text_to_speech(response)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response,
-                        "timestamp": time.strftime("%H:%M"),
-                        "audio": audio_data
-                    })
-                else:
-                    st.error(status)
+                prune_audio(st.session_state.messages)
             else:
                 st.error(status)
+        else:
+            st.error(status)
         
         st.session_state.is_processing = False
-        st.session_state.processing_uploaded_audio = False
+        st.session_state[flag_key] = False
         
-        # Reset file uploader to prevent loop
-        st.session_state.upload_counter += 1
-        st.rerun()  # Refresh frontend to hide loading overlay
+        # Show the new turn, hide loading and reset the uploader in place
+        # (new key) instead of a full-script rerun
+        show_new_messages(chat_container, empty_notice, turn_start)
+        overlay_slot.empty()
+        st.session_state[counter_key] += 1
+        render_uploader(slot)
+    finally:
+        # Recorded even if the turn raised, so this upload can't start it
+        # again and a stale flag can't block the other source
+        st.session_state.last_audio_hash = audio_hash
+        st.session_state[flag_key] = False
+        st.session_state.is_processing = False
+
+def main():
+    """Main counseling app - Optimized UI"""
+    
+    # Initialize session state
+    if 'messages' not in st.session_state:
+        st.session_state.messages = []
+    if 'api_url' not in st.session_state:
+        st.session_state.api_url = "http://localhost:8000/api/v1/rag/query"
+    if 'api_key' not in st.session_state:
+        st.session_state.api_key = "demo_key_123"
+    if 'is_processing' not in st.session_state:
+        st.session_state.is_processing = False
+    if 'processing_uploaded_audio' not in st.session_state:
+        st.session_state.processing_uploaded_audio = False
+    if 'upload_counter' not in st.session_state:
+        st.session_state.upload_counter = 0
+    if 'processing_voice_audio' not in st.session_state:
+        st.session_state.processing_voice_audio = False
+    if 'voice_upload_counter' not in st.session_state:
+        st.session_state.voice_upload_counter = 0
+    
+    # Start loading the speech model while the user is still recording;
+    # get_components() blocks on the same cache entry if it isn't done yet
+    start_model_warmup()
+    
+    # Audio processing is now handled by file uploaders only
+    
+    # Apply CSS
+    st.markdown(CSS_STYLES, unsafe_allow_html=True)
+    
+    # Main layout - Header only
+    st.markdown('''
+    <div style="display: flex; flex-direction: column; overflow: hidden;">
+        <div class="chat-title">
+            <div style="display: flex; align-items: center; gap: 12px;">
+                <span style="font-size: 24px;">🏥</span>
+                <span>AI Psychological Counseling</span>
+            </div>
+            <div style="display: flex; flex-direction: column; align-items: flex-end; font-size: 12px; line-height: 1.2;">
+                <div style="font-weight: 600; font-size: 14px;">Psychological Expert</div>
+                <div>Nguyen Minh Quang, Nguyen Ngoc Bach, Nguyen Vu Dung</div>
+            </div>
+        </div>
+    ''', unsafe_allow_html=True)
+    
+    # Display chat messages
+    
+    # Clear session button
+    if st.sidebar.button("🗑️ Clear All Messages"):
+        st.session_state.messages = []
+        forget_transcripts(st.session_state.pop('transcript_digests', set()))
+        # Drop every cached piece of the old history so none of it can be
+        # rendered again for the new conversation
+        for key in ('history_window', 'history_parts', 'history_block', 'history_block_key'):
+            st.session_state.pop(key, None)
+        st.session_state.processing_uploaded_audio = False
+        st.rerun()
+    
+    
+    # Chat area; upload handlers append new turns into it later in the run
+    chat_container = st.container()
+    
+    # Test message display
+    empty_notice = chat_container.empty()
+    if len(st.session_state.messages) == 0:
+        empty_notice.markdown("**No messages yet. Upload an audio file to start!**")
+    
+    # Style message containers once, not once per message
+    st.markdown(CHAT_MESSAGE_CSS, unsafe_allow_html=True)
+    
+    # Older messages render as one text-only HTML block (no audio players)
+    # whose rows are built once each; the block only carries the newest
+    # HISTORY_PAGE_MESSAGES rows unless the user pages further back. Only
+    # messages new since the last run (and the latest exchange) get bubbles
+    messages = st.session_state.messages
+    history_len = max(0, min(st.session_state.get('last_rendered_len', 0), len(messages) - RICH_TAIL_MESSAGES))
+    history_parts = st.session_state.setdefault('history_parts', [])
+    if len(history_parts) > history_len:
+        # Chat was cleared (or shrank): rebuild from scratch
+        del history_parts[:]
+    if len(history_parts) < history_len:
+        history_parts.extend(history_message_html(m) for m in messages[len(history_parts):history_len])
+    if history_len:
+        with chat_container:
+            render_history()
+    st.session_state.last_rendered_len = len(messages)
+    
+    # Display new messages with structure: chat-container -> stLayoutWrapper -> stChatMessage
+    with chat_container:
+        for message in messages[history_len:]:
+            render_message(message)
+    
+    # Auto-scroll to bottom after displaying messages
+    st.markdown('''
+    <script>
+    // Auto-scroll to bottom of the page to show latest messages
+    setTimeout(function() {
+        window.scrollTo({
+            top: document.body.scrollHeight,
+            behavior: 'smooth'
+        });
+    }, 100);
+    </script>
+    ''', unsafe_allow_html=True)
+    
+    # Processing Loading Overlay - Show at the very end to ensure it's on top
+    overlay_slot = st.empty()
+    if st.session_state.is_processing:
+        overlay_slot.markdown(PROCESSING_OVERLAY_HTML, unsafe_allow_html=True)
+    
+    
+    # Independent Voice Chat Button (positioned separately like file uploader)
+    st.markdown('''
+        <div class="voice-chat-container">
+            <button class="voice-chat-button" id="voiceChatBtn">Voice Chat</button>
+        </div>
+    ''', unsafe_allow_html=True)
+    
+    
+    # JavaScript for voice recording using components.v1.html
+    st.components.v1.html(VOICE_RECORDER_JS, height=0)
+    
+
+    # File uploader for audio files - Now integrated into footer
+    upload_slot = st.empty()
+    uploaded_audio = render_audio_uploader(upload_slot)
+    
+    
+    # VOICE RECORDING: Hidden file uploader for voice data
+    voice_slot = st.empty()
+    voice_audio_file = render_voice_uploader(voice_slot)
+    
+    
+
+    
+    # Voice recordings first, then file uploads; a turn only starts while
+    # the other source isn't mid-processing
+    for upload, flag_key, other_flag_key, counter_key, key_prefix, slot, render_uploader, label in (
+        (voice_audio_file, 'processing_voice_audio', 'processing_uploaded_audio', 'voice_upload_counter',
+         'voice_recording_uploader_', voice_slot, render_voice_uploader, "Voice file"),
+        (uploaded_audio, 'processing_uploaded_audio', 'processing_voice_audio', 'upload_counter',
+         'audio_uploader_', upload_slot, render_audio_uploader, "File"),
+    ):
+        if not upload:
+            continue
+        # Skip an upload this uploader has already turned into a chat turn
+        audio_hash = upload_digest(upload, f"{key_prefix}{st.session_state[counter_key]}")
+        if audio_hash == st.session_state.get('last_audio_hash'):
+            continue
+        if not st.session_state.get(flag_key, False) and not st.session_state.get(other_flag_key, False):
+            st.session_state[flag_key] = True
+            st.session_state.is_processing = True
+            # Show the overlay and process in this same run instead of paying a
+            # second full-script rerun just to render it
+            overlay_slot.markdown(PROCESSING_OVERLAY_HTML, unsafe_allow_html=True)
+        if st.session_state.get(flag_key, False):
+            _handle_audio_upload(
+                upload, audio_hash, flag_key, counter_key, key_prefix, label,
+                slot, render_uploader, overlay_slot, chat_container, empty_notice
+            )
 
 
 if __name__ == "__main__":
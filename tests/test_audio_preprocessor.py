@@ -0,0 +1,38 @@
+"""
+Tests for in-memory audio decoding in AudioPreprocessor
+"""
+import io
+import shutil
+
+import pytest
+
+pytest.importorskip("soundfile")
+pydub = pytest.importorskip("pydub")
+
+from audio_preprocessor import AudioPreprocessor
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+
+
+def _webm_opus_bytes(duration_ms: int = 500) -> bytes:
+    """Encode a short tone the way Chrome's MediaRecorder does (WebM/Opus)"""
+    from pydub.generators import Sine
+
+    buf = io.BytesIO()
+    Sine(440).to_audio_segment(duration=duration_ms).export(buf, format="webm", codec="libopus")
+    return buf.getvalue()
+
+
+@requires_ffmpeg
+def test_load_audio_stream_decodes_webm_labelled_as_wav():
+    """A recording named voice_recording.wav that is really WebM still decodes"""
+    preprocessor = AudioPreprocessor()
+
+    audio, sample_rate = preprocessor.load_audio_stream(io.BytesIO(_webm_opus_bytes()), format="wav")
+
+    assert sample_rate > 0
+    assert audio.ndim == 1
+    assert audio.dtype.name == "float32"
+    # ~0.5 s of audio, allowing for codec padding
+    assert 0.4 * sample_rate < audio.shape[0] < 0.7 * sample_rate
+    assert abs(audio).max() > 0
@@ -3,20 +3,25 @@ Text postprocessing module for Vietnamese Speech-to-Text
 Handles text cleaning, normalization, and punctuation
 """
 import re
+import unicodedata
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Patterns are compiled once at import instead of on every call
+_WHITESPACE_RE = re.compile(r'\s+')
+_ARTIFACT_RE = re.compile(r'[^\w\s.,!?;:()\-]')
+_SENTENCE_SPLIT_RE = re.compile(r'([.!?]+)')
+
 class TextPostprocessor:
     """Text postprocessing class for Vietnamese speech-to-text"""
     
     def __init__(self):
         # Vietnamese punctuation patterns
         self.punctuation_patterns = {
-            r'\s+([.!?])': r'\1',  # Remove spaces before punctuation
-            r'([.!?])\s*([a-z])': r'\1 \2',  # Add space after punctuation
-            r'([.!?])\s*([A-Z])': r'\1 \2',  # Add space after punctuation for capital letters
+            re.compile(r'\s+([.!?])'): r'\1',  # Remove spaces before punctuation
+            re.compile(r'([.!?])\s*([a-zA-Z])'): r'\1 \2',  # Add space after punctuation (either case)
         }
         
         # Common Vietnamese abbreviations and their expansions
@@ -55,17 +60,18 @@ class TextPostprocessor:
         """
         try:
             # Remove extra whitespace
-            text = re.sub(r'\s+', ' ', text)
+            text = _WHITESPACE_RE.sub(' ', text)
             
             # Remove leading/trailing whitespace
             text = text.strip()
             
-            # Remove special characters that might be artifacts
-            text = re.sub(r'[^\w\s.,!?;:()\-]', '', text)
-            
-            # Normalize Vietnamese characters
+            # Normalize Vietnamese characters (before stripping artifacts, which
+            # would otherwise drop decomposed combining marks)
             text = self._normalize_vietnamese_chars(text)
             
+            # Remove special characters that might be artifacts
+            text = _ARTIFACT_RE.sub('', text)
+            
             logger.info("Text cleaned successfully")
             return text
             
@@ -83,28 +89,9 @@ class TextPostprocessor:
         Returns:
             Normalized text
         """
-        # Common character normalizations
-        char_mappings = {
-            'à': 'à', 'á': 'á', 'ả': 'ả', 'ã': 'ã', 'ạ': 'ạ',
-            'ă': 'ă', 'ằ': 'ằ', 'ắ': 'ắ', 'ẳ': 'ẳ', 'ẵ': 'ẵ', 'ặ': 'ặ',
-            'â': 'â', 'ầ': 'ầ', 'ấ': 'ấ', 'ẩ': 'ẩ', 'ẫ': 'ẫ', 'ậ': 'ậ',
-            'è': 'è', 'é': 'é', 'ẻ': 'ẻ', 'ẽ': 'ẽ', 'ẹ': 'ẹ',
-            'ê': 'ê', 'ề': 'ề', 'ế': 'ế', 'ể': 'ể', 'ễ': 'ễ', 'ệ': 'ệ',
-            'ì': 'ì', 'í': 'í', 'ỉ': 'ỉ', 'ĩ': 'ĩ', 'ị': 'ị',
-            'ò': 'ò', 'ó': 'ó', 'ỏ': 'ỏ', 'õ': 'õ', 'ọ': 'ọ',
-            'ô': 'ô', 'ồ': 'ồ', 'ố': 'ố', 'ổ': 'ổ', 'ỗ': 'ỗ', 'ộ': 'ộ',
-            'ơ': 'ơ', 'ờ': 'ờ', 'ớ': 'ớ', 'ở': 'ở', 'ỡ': 'ỡ', 'ợ': 'ợ',
-            'ù': 'ù', 'ú': 'ú', 'ủ': 'ủ', 'ũ': 'ũ', 'ụ': 'ụ',
-            'ư': 'ư', 'ừ': 'ừ', 'ứ': 'ứ', 'ử': 'ử', 'ữ': 'ữ', 'ự': 'ự',
-            'ỳ': 'ỳ', 'ý': 'ý', 'ỷ': 'ỷ', 'ỹ': 'ỹ', 'ỵ': 'ỵ',
-            'đ': 'đ'
-        }
-        
-        # Apply character mappings
-        for old_char, new_char in char_mappings.items():
-            text = text.replace(old_char, new_char)
-        
-        return text
+        # One NFC pass composes base letters + combining tone/vowel marks
+        # (e.g. "a" + U+0301 -> "á") instead of a str.replace scan per character
+        return unicodedata.normalize('NFC', text)
     
     def add_punctuation(self, text: str) -> str:
         """
@@ -123,7 +110,7 @@ class TextPostprocessor:
             
             # Apply punctuation patterns
             for pattern, replacement in self.punctuation_patterns.items():
-                text = re.sub(pattern, replacement, text)
+                text = pattern.sub(replacement, text)
             
             logger.info("Punctuation added successfully")
             return text
@@ -144,7 +131,7 @@ class TextPostprocessor:
         """
         try:
             # Split by sentence endings
-            sentences = re.split(r'([.!?]+)', text)
+            sentences = _SENTENCE_SPLIT_RE.split(text)
             
             result = []
             for i, part in enumerate(sentences):
@@ -216,7 +203,7 @@ class TextPostprocessor:
                 return json.dumps({"transcription": text}, ensure_ascii=False, indent=2)
             elif format_type == "formatted":
                 # Add line breaks for better readability
-                sentences = re.split(r'([.!?]+)', text)
+                sentences = _SENTENCE_SPLIT_RE.split(text)
                 formatted = []
                 for i, part in enumerate(sentences):
                     if i % 2 == 0 and part.strip():  # Text part
@@ -0,0 +1,115 @@
+"""
+Background text-to-speech worker
+Runs synthesis off the Streamlit script thread with a submit/poll interface
+"""
+import hashlib
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class TTSWorker:
+    """
+    Shared TTS worker with a submission queue and a completion table
+    
+    submit() enqueues text and returns immediately with a request id; a
+    daemon thread drains up to max_batch_size pending requests at a time and
+    synthesizes them concurrently on the executor. Callers poll() for the
+    audio, so the UI never blocks on synthesis.
+    """
+    
+    def __init__(self, synthesize: Callable[[str], Optional[bytes]], executor: Optional[Executor] = None,
+                 max_batch_size: int = 8, max_results: int = 256):
+        self.synthesize = synthesize
+        self.max_batch_size = max_batch_size
+        self.max_results = max_results
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_batch_size, thread_name_prefix="tts-worker")
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending = set()
+        self._inflight: Dict[str, str] = {}
+        self._results: "OrderedDict[str, Optional[bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="tts-dispatcher", daemon=True)
+        self._worker.start()
+    
+    def submit(self, text: str) -> str:
+        """
+        Queue text for synthesis
+        
+        Args:
+            text: Text to synthesize
+        
+        Returns:
+            Request id to pass to poll(); identical text already in flight
+            shares the existing request instead of being synthesized twice
+        """
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        with self._lock:
+            request_id = self._inflight.get(digest)
+            if request_id is not None:
+                return request_id
+            request_id = uuid.uuid4().hex
+            self._inflight[digest] = request_id
+            self._pending.add(request_id)
+        self._queue.put((request_id, digest, text))
+        return request_id
+    
+    def poll(self, request_id: str) -> Optional[bytes]:
+        """
+        Get the audio for a request if it has finished
+        
+        Args:
+            request_id: Id returned by submit()
+        
+        Returns:
+            Audio bytes, or None while pending, on failure, or once evicted
+        """
+        with self._lock:
+            return self._results.get(request_id)
+    
+    def failed(self, request_id: str) -> bool:
+        """Whether a request finished without producing audio"""
+        with self._lock:
+            return request_id in self._results and self._results[request_id] is None
+    
+    def healthy(self) -> bool:
+        """Whether the dispatcher thread is still running"""
+        return self._worker.is_alive()
+    
+    def is_pending(self, request_id: str) -> bool:
+        """Whether a request is still queued or being synthesized"""
+        with self._lock:
+            return request_id in self._pending
+    
+    def _run(self) -> None:
+        """Drain the queue in batches and dispatch them to the executor"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for request_id, digest, text in batch:
+                self._executor.submit(self._synthesize_one, request_id, digest, text)
+    
+    def _synthesize_one(self, request_id: str, digest: str, text: str) -> None:
+        """Synthesize one request and publish its result"""
+        try:
+            audio = self.synthesize(text)
+        except Exception as e:
+            logger.error(f"TTS worker error: {e}")
+            audio = None
+        
+        with self._lock:
+            self._pending.discard(request_id)
+            self._inflight.pop(digest, None)
+            self._results[request_id] = audio
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)